@@ -1,8 +1,14 @@
-import shutil, json, sqlite3, argparse
+import shutil, json, sqlite3, argparse, itertools, time
+from functools import partial
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
+from typing import Optional
 from zipfile import ZipFile, ZipInfo
 
-from lib import Client, util, xxtea, gameconfig, decompile
+from lib import Client, util, xxtea, gameconfig, decompile, textindex, texture, profiling
+from lib.store import ContentStore
+from lib.journal import Journal
+from lib.packfile import PackArchive, is_unpacked
 
 
 def execute_clear(*args: Path):
@@ -11,27 +17,47 @@ def execute_clear(*args: Path):
 			shutil.rmtree(dir_, ignore_errors=True)
 
 
-def extract_file(zipfile: ZipFile, srcpath: ZipInfo, targetpath: Path, do_mkdirs: bool = False):
+def extract_file(zipfile: ZipFile, srcpath: ZipInfo, targetpath: Path, do_mkdirs: bool = False, store: Optional[ContentStore] = None, archive: Optional[PackArchive] = None):
+	"""
+	Decrypts a file of the zipfile into targetpath.
+	If an archive is given, targetpath is the relative path of the file inside the archive.
+	"""
 	if srcpath.is_dir():
-		targetpath.mkdir(exist_ok=True)
+		if not archive: targetpath.mkdir(exist_ok=True)
+	elif archive:
+		with zipfile.open(srcpath, 'r') as assetfile:
+			archive.write(targetpath.as_posix(), xxtea.decrypt(assetfile.read()))
 	else:
 		if do_mkdirs: util.mkdirs(targetpath)
+		if store:
+			with zipfile.open(srcpath, 'r') as assetfile:
+				store.materialize(assetfile.read(), targetpath, xxtea.decrypt)
+			return
 		with zipfile.open(srcpath, 'r') as assetfile, open(targetpath, 'wb') as assettargetfile:
 			filebytes = assetfile.read()
 			filebytes = xxtea.decrypt(filebytes)
 			assettargetfile.write(filebytes)
 
-def extract_obb(zipfile: ZipFile, obbpath: str, targetfolder: Path):
+def extract_obb(zipfile: ZipFile, obbpath: str, targetfolder: Path, store: Optional[ContentStore] = None, journal: Optional[Journal] = None, archive: Optional[PackArchive] = None):
+	stage = f"extract:{obbpath}"
+	if journal and journal.is_done(stage):
+		print(f"Skipping {obbpath}, it was already unpacked.")
+		return
+	extracted = journal.done_members(stage) if journal else {}
+
 	with zipfile.open(obbpath, 'r') as mainobbfile:
 		with ZipFile(mainobbfile, 'r') as main_obb:
 			fileamount = len(main_obb.filelist)
-			progressbar = util.ProgressBar(fileamount, prefix='Unpacking:')
+			progressbar = util.ProgressBar(fileamount, prefix='Unpacking:', iterstart=len(extracted))
 			for i, file in enumerate(main_obb.filelist, 1):
-				targetpath = Path(targetfolder, file.filename)
-				extract_file(main_obb, file, targetpath)
+				if file.filename in extracted: continue
+				targetpath = Path(file.filename) if archive else Path(targetfolder, file.filename)
+				extract_file(main_obb, file, targetpath, store=store, archive=archive)
+				if journal: journal.mark(stage, file.filename)
 				progressbar.update(i)
+	if journal: journal.finish(stage)
 
-def execute_extraction(xapk_path: Path, unpack_targetdir: Path):
+def execute_extraction(xapk_path: Path, unpack_targetdir: Path, store: Optional[ContentStore] = None, journal: Optional[Journal] = None, archive: Optional[PackArchive] = None):
 	print("Unpacking XAPK archive...")
 	util.mkdir(unpack_targetdir)
 	with ZipFile(xapk_path, 'r') as xapk_archive:
@@ -41,19 +67,23 @@ def execute_extraction(xapk_path: Path, unpack_targetdir: Path):
 	
 		print("Unpacking additional asset archives...")
 		for obb_expansion in manifest['expansions']:
-			extract_obb(xapk_archive, obb_expansion['file'], unpack_targetdir)
+			extract_obb(xapk_archive, obb_expansion['file'], unpack_targetdir, store, journal, archive)
 		
 		print('Unpacking APK archive...')
 		APK_PATH = manifest['split_apks'][0]['file']
 		with xapk_archive.open(APK_PATH, 'r') as apk_archivefile:
 			with ZipFile(apk_archivefile, 'r') as apk_archive:
 				print('Extracting apk assets...')
+				stage = f"extract:{APK_PATH}"
+				extracted = journal.done_members(stage) if journal else {}
 				fileamount = len(apk_archive.filelist)
 				progressbar = util.ProgressBar(fileamount, prefix='Unpacking:')
 				for i, file in enumerate(apk_archive.filelist, 1):
-					if file.filename.startswith('assets/release/'):
-						targetpath = Path(unpack_targetdir, file.filename.lstrip('assets/'))
-						extract_file(apk_archive, file, targetpath, True)
+					if file.filename.startswith('assets/release/') and file.filename not in extracted:
+						targetpath = Path(file.filename.lstrip('assets/'))
+						if not archive: targetpath = Path(unpack_targetdir, targetpath)
+						extract_file(apk_archive, file, targetpath, True, store, archive)
+						if journal: journal.mark(stage, file.filename)
 					progressbar.update(i)
 				
 				print('Extracting assets.db...')
@@ -66,63 +96,162 @@ def execute_extraction(xapk_path: Path, unpack_targetdir: Path):
 				conftarget = Path(unpack_targetdir, 'cocos_app.conf')
 				extract_file(apk_archive, confinfo, conftarget)
 				
+	if archive: archive.commit()
 	print("Finished extraction.")
 
-def rename_file(src: Path, target: Path, no_copy):
-	if target.exists(): return False
-	util.mkdirs(target)
-	if no_copy: shutil.copyfile(src, target)
-	else: src.rename(target)
-	return True
+RENAME_WINDOW = 4096 # amount of database files that are planned and renamed together
+
+def make_target_dir(dirpath: Path, created_dirs: set):
+	"""Creates the directory if it was not already created during this run."""
+	if dirpath not in created_dirs:
+		dirpath.mkdir(parents=True, exist_ok=True)
+		created_dirs.add(dirpath)
+
+def asset_columns(conn: sqlite3.Connection) -> tuple[str, str]:
+	"""Returns the names of the assetpath and dbpath columns of the assets table."""
+	# columns of the assets table: assetpath, version, dbpath, size, hash, external
+	# external	- 0: other files
+	#			- 1: video/sound files
+	# version	- seems to be always same for all files
+	columns = [column[1] for column in conn.execute('PRAGMA table_info(assets)')]
+	return columns[0], columns[2]
+
+def read_asset_groups(assetdb_path: Path):
+	"""Yields (dbpath, assetpaths) for every file of the asset database in order of dbpath."""
+	conn = sqlite3.connect(str(assetdb_path))
+	try:
+		assetcolumn, dbcolumn = asset_columns(conn)
+		rows = conn.execute(f'SELECT "{dbcolumn}", "{assetcolumn}" FROM assets ORDER BY "{dbcolumn}", "{assetcolumn}"')
+		for dbpath, group in itertools.groupby(rows, key=lambda row: row[0]):
+			yield dbpath, [assetpath for _, assetpath in group]
+	finally:
+		conn.close()
+
+def rename_file(src: Path, target: Path, no_copy, dedupe: bool = False) -> Optional[int]:
+	"""
+	Moves src to target, or copies it if no_copy is set. If dedupe is set, target gets
+	linked to src instead of copied if possible. The target directory has to exist.
 
-def execute_rename(unpack_dir: Path, rename_targetdir: Path):
+	Returns None if the target already exists, otherwise the amount of bytes
+	that were linked instead of copied.
+	"""
+	if target.exists(): return None
+	if not no_copy:
+		src.rename(target)
+	elif dedupe:
+		if util.link_or_copy(src, target):
+			return target.stat().st_size
+	else:
+		shutil.copyfile(src, target)
+	return 0
+
+def rename_batch(batch: list[tuple[Path, Path, bool]], dedupe: bool = False):
+	return [(src, target, rename_file(src, target, no_copy, dedupe)) for src, target, no_copy in batch]
+
+def rename_archived_file(archive: PackArchive, dbpath: str, targetpaths: list[str], rename_targetdir: Path, errorlogger: util.ErrorLogger, created_dirs: set):
+	for targetpath in targetpaths:
+		if is_unpacked(targetpath):
+			# files that get processed further are written out of the archive
+			filetarget = Path(rename_targetdir, targetpath)
+			if filetarget.exists():
+				errorlogger.add_message(f"Error on: {dbpath} -> {filetarget}: Target already exists.")
+				continue
+			make_target_dir(filetarget.parent, created_dirs)
+			with open(filetarget, 'wb') as f:
+				f.write(archive.read(dbpath))
+		elif archive.exists(targetpath):
+			errorlogger.add_message(f"Error on: {dbpath} -> {targetpath}: Target already exists in archive.")
+		else:
+			archive.link(dbpath, targetpath)
+	archive.delete(dbpath)
+
+def execute_rename(unpack_dir: Path, rename_targetdir: Path, dedupe: bool = False, journal: Optional[Journal] = None, archive: Optional[PackArchive] = None, threads: int = 8):
 	print("Reading asset database...")
 	ASSETDB_PATH = Path(unpack_dir, 'assets.db')
 	conn = sqlite3.connect(str(ASSETDB_PATH))
-	c = conn.cursor()
-	c.execute('SELECT * FROM assets')
-	result = c.fetchall()
+	_, dbcolumn = asset_columns(conn)
+	fileamount = conn.execute(f'SELECT COUNT(DISTINCT "{dbcolumn}") FROM assets').fetchone()[0]
 	conn.close()
-
-	print("Categorizing assets...")
-	categorizeddata = {}
-	fileamount = len(result)
-	progressbar = util.ProgressBar(fileamount, prefix='Categorizing:')
-	for i, datarow in enumerate(result, 1):
-		assetpath, _, dbpath, _, _, _ = datarow
-		# assetpath, version dbpath, size, hash, external
-		# external	- 0: other files
-		#			- 1: video/sound files
-		# version	- seems to be always same for all files
-		if dbpath in categorizeddata:
-			categorizeddata[dbpath].append(assetpath)
-		else:
-			categorizeddata[dbpath] = [assetpath]
-		progressbar.update(i)
+	asset_groups = read_asset_groups(ASSETDB_PATH)
 
 	print("Renaming asset paths...")
 	errorlogger = util.ErrorLogger("rename_errors.log")
-	catdatalen = len(categorizeddata)
-	progressbar = util.ProgressBar(catdatalen, prefix='Renaming:')
-	for i, filedata in enumerate(categorizeddata.items(), 1):
-		dbpath, targetpaths = filedata
-		srcpath = Path(unpack_dir, dbpath)
-		if srcpath.exists():
-			for j, targetpath in enumerate(targetpaths):
-				filetarget = Path(rename_targetdir, targetpath)
-				if not rename_file(srcpath, filetarget, j):
-					errorlogger.add_message(f"Error on: {srcpath} -> {filetarget}: Target already exists.")
-				if j == 0:
-					srcpath = filetarget
-		else:
-			errorlogger.add_message(f"{srcpath} of {assetpath} can not be found.\n")
-		progressbar.update(i)
+	bytes_saved = 0
+	renamed = journal.done_members("rename") if journal else {}
+	# only a renaming started by an earlier run can have moved files without marking them
+	resuming = journal is not None and journal.is_started("rename")
+	if journal: journal.begin("rename")
+	created_dirs = set()
+	progress = 0
+	progressbar = util.ProgressBar(fileamount, prefix='Renaming:')
+	with ThreadPool(threads) as pool:
+		while window := list(itertools.islice(asset_groups, RENAME_WINDOW)):
+			progress += len(window)
+			# all files of a target directory are renamed in one batch, the moves out of the
+			# unpack directory happen before the copies, as the copies are made from the moved files
+			moves, copies, finished = {}, {}, []
+			for dbpath, targetpaths in window:
+				if dbpath in renamed: continue
+				if archive:
+					if archive.exists(dbpath):
+						rename_archived_file(archive, dbpath, targetpaths, rename_targetdir, errorlogger, created_dirs)
+						finished.append(dbpath)
+					else:
+						errorlogger.add_message(f"{dbpath} can not be found in archive.")
+					continue
+				srcpath = Path(unpack_dir, dbpath)
+				firsttarget = Path(rename_targetdir, targetpaths[0])
+				# a resumed renaming may have been interrupted after the file was moved to its first target
+				resumed = resuming and not srcpath.exists() and firsttarget.exists()
+				if not resumed and not srcpath.exists():
+					errorlogger.add_message(f"{srcpath} of {', '.join(targetpaths)} can not be found.")
+					continue
+				if not resumed:
+					moves.setdefault(firsttarget.parent, []).append((srcpath, firsttarget, False))
+				for targetpath in targetpaths[1:]:
+					filetarget = Path(rename_targetdir, targetpath)
+					if resumed and filetarget.exists(): continue
+					copies.setdefault(filetarget.parent, []).append((srcpath, firsttarget, filetarget))
+				finished.append(dbpath)
+
+			for dirpath in itertools.chain(moves, copies):
+				make_target_dir(dirpath, created_dirs)
+			unmoved = set()
+			for results in pool.imap_unordered(partial(rename_batch, dedupe=dedupe), moves.values()):
+				for src, target, linked_bytes in results:
+					if linked_bytes is None:
+						errorlogger.add_message(f"Error on: {src} -> {target}: Target already exists.")
+						unmoved.add(src)
+			# files that could not be moved, because their first target already exists, are copied from the unpack directory
+			copybatches = [[(srcpath if srcpath in unmoved else firsttarget, filetarget, True) for srcpath, firsttarget, filetarget in batch] for batch in copies.values()]
+			for results in pool.imap_unordered(partial(rename_batch, dedupe=dedupe), copybatches):
+				for src, target, linked_bytes in results:
+					if linked_bytes is None:
+						errorlogger.add_message(f"Error on: {src} -> {target}: Target already exists.")
+					else:
+						bytes_saved += linked_bytes
+
+			if journal:
+				for dbpath in finished:
+					journal.mark("rename", dbpath)
+			progressbar.update(progress)
 	errorlogger.output()
+	if archive: archive.commit()
+	if dedupe:
+		print(f"Deduplication saved {bytes_saved / 1024**2:.1f} MiB.")
 	print("Finished renaming.")
 
-def execute_tidy(unpack_dir: Path, target_dir: Path):
+def execute_tidy(unpack_dir: Path, target_dir: Path, archive: Optional[PackArchive] = None, archive_target_dir: str = None):
 	print("Tidying up remaining files...")
 	util.mkdir(target_dir)
+	if archive:
+		for path in list(archive.paths('release/')):
+			filename = path.rsplit('/', 1)[-1]
+			if filename.endswith('.luac') or filename == '.packres_success':
+				archive.delete(path)
+			else:
+				archive.rename(path, f"{archive_target_dir}/{filename}")
+		archive.commit()
 	for filepath in Path(unpack_dir, 'release').rglob('*'):
 		if filepath.is_dir(): continue
 		if filepath.suffix == '.luac': continue # skip 32 bit lua files
@@ -131,7 +260,8 @@ def execute_tidy(unpack_dir: Path, target_dir: Path):
 
 	# rename the config file
 	confpath = Path(unpack_dir, 'cocos_app.conf')
-	confpath.rename(Path(target_dir, confpath.name))
+	if confpath.exists():
+		confpath.rename(Path(target_dir, confpath.name))
 
 	print("Removing unpack directory...")
 	execute_clear(unpack_dir)
@@ -139,31 +269,37 @@ def execute_tidy(unpack_dir: Path, target_dir: Path):
 
 def execute_gc_extract(client_asset_dir: Path, json_out_dir: Path):
 	gc_archive_path = Path(client_asset_dir, "gameConfig.db.zip")
+	gc_db_path = Path(client_asset_dir, "gameConfig.db")
 	if gc_archive_path.exists():
 		with ZipFile(gc_archive_path, 'r') as gc_archive:
 			gc_archive.extractall(client_asset_dir)
 		gc_archive_path.unlink()
-
-		# decrypt and convert database
-		gc_db_path = Path(client_asset_dir, "gameConfig.db")
-		gameconfig.decrypt_db(gc_db_path)
-		gameconfig.convert_db(gc_db_path, json_out_dir)
-	else:
+	elif not gc_db_path.exists():
+		# the database only exists without the archive if a previous run was interrupted
 		print("Can't unpack gameconfig archive: doens't exist.")
+		return
 
-if __name__ == "__main__":
-	# execute parser to allow easy commandline execution
-	parser = argparse.ArgumentParser()
+	# decrypt and convert database
+	gameconfig.decrypt_db(gc_db_path)
+	gameconfig.convert_db(gc_db_path, json_out_dir)
+
+def add_arguments(parser: argparse.ArgumentParser):
 	parser.add_argument('xapk', metavar='PATH', type=str, nargs='?', help="Path to the XAPK archive. Required if --extract is True.")
 	parser.add_argument('-c', '--client', type=str, help="The client to apply the action to. If not given, an attempt to extract it from xapk archive.")
+	parser.add_argument('--resume', action='store_true', help="Resumes an interrupted import, skipping all finished stages and files.")
 	parser.add_argument('--clear', type=bool, default=True, action=argparse.BooleanOptionalAction, help="Sets the auto-deletion of all existing assets.")
 	parser.add_argument('--extract', type=bool, default=True, action=argparse.BooleanOptionalAction, help="Sets whether files should be extracted.")
 	parser.add_argument('--rename', type=bool, default=True, action=argparse.BooleanOptionalAction, help="Sets whether all files should be rename.")
+	parser.add_argument('--dedupe', type=bool, default=False, action=argparse.BooleanOptionalAction, help="Sets whether assets sharing the same data are linked instead of copied.")
+	parser.add_argument('--packed', type=bool, default=None, action=argparse.BooleanOptionalAction, help="Sets whether the assets are stored in pack files instead of single files. Defaults to the AssetLayout of the config.")
 	parser.add_argument('--tidy', type=bool, default=True, action=argparse.BooleanOptionalAction, help="Sets whether the remaining files should be cleaned up.")
 	parser.add_argument('--gameconfig', type=bool, default=True, action=argparse.BooleanOptionalAction, help="Sets whether the gameconfig database should be extracted.")
 	parser.add_argument('--decompile', type=bool, default=True, action=argparse.BooleanOptionalAction, help="Sets whether the lua files should get decompiled.")
-	args = parser.parse_args()
+	parser.add_argument('--index', type=bool, default=True, action=argparse.BooleanOptionalAction, help="Sets whether the text search index should be rebuilt.")
+	parser.add_argument('--profile', metavar='DIR', type=str, nargs='?', const='', help="Profiles the cpu time and memory of every stage and writes the results into DIR, by default into profile/<time>.")
+	parser.add_argument('--textures', type=bool, default=None, action=argparse.BooleanOptionalAction, help="Sets whether the images should be transcoded into the TextureDir. Defaults to whether a TextureDir is set in the config.")
 
+def run(args: argparse.Namespace):
 	# make sure additional argument requirements are fullfilled
 	if args.extract and not args.xapk:
 		print("If extract is enabled, a path to an xapk archive is needed.")
@@ -192,22 +328,89 @@ if __name__ == "__main__":
 	LEFT_FILES_PATH = Path(RENAME_TARGET_PATH, config['AssetRemainDir'])
 	LUA_DIR = Path(RENAME_TARGET_PATH, 'script')
 	JSON_DIR = Path(RENAME_TARGET_PATH, config['GameConfigJsonDir'])
+	STORE = ContentStore(config['ContentStore']) if config.get('ContentStore') else None
+	STATE_DIR = Path(config['StateDir'].format(client = CLIENT.locale_code))
+	TEXT_INDEX_PATH = Path(STATE_DIR, "text_index.db")
+	PACK_DIR = Path(STATE_DIR, config['PackDir'])
+	TEXT_INDEX_DIRS = [('script', '.lua'), (config['GameConfigJsonDir'], '.json')]
+	TEXTURE_DIR = Path(config['TextureDir'].format(client = CLIENT.locale_code)) if config.get('TextureDir') else None
+	TEXTURE_CACHE_PATH = Path(STATE_DIR, "texture_cache.db")
+	if args.packed is None:
+		args.packed = config.get('AssetLayout') == 'packed'
+	if args.textures is None:
+		args.textures = TEXTURE_DIR is not None
+	elif args.textures and TEXTURE_DIR is None:
+		print("Cannot transcode textures if no TextureDir is set in the config.")
+		exit(1)
+
+	if args.profile is not None:
+		profiling.enable(args.profile or Path("profile", time.strftime("%Y%m%d-%H%M%S")))
+
+	# the journal records the progress, so an interrupted import can be resumed
+	JOURNAL = Journal(Path(STATE_DIR, "import_journal.db"))
+	if not args.resume:
+		JOURNAL.clear()
+	def should_run(stage: str, enabled: bool) -> bool:
+		if enabled and JOURNAL.is_done(stage):
+			print(f"Skipping {stage}, it already finished.")
+			return False
+		return enabled
 
 	# check execution flags and execute
-	if args.clear:
-		execute_clear(UNPACK_PATH, RENAME_TARGET_PATH, LEFT_FILES_PATH)
+	if should_run("clear", args.clear):
+		with profiling.stage("clear"):
+			execute_clear(UNPACK_PATH, RENAME_TARGET_PATH, LEFT_FILES_PATH, PACK_DIR)
+		JOURNAL.finish("clear")
+
+	ARCHIVE = None
+	if args.packed:
+		ARCHIVE = PackArchive(PACK_DIR)
+		JOURNAL.before_flush.append(ARCHIVE.commit)
 
-	if args.extract:
-		execute_extraction(Path(args.xapk), UNPACK_PATH)
+	if should_run("extract", args.extract):
+		with profiling.stage("extract"):
+			execute_extraction(Path(args.xapk), UNPACK_PATH, STORE, JOURNAL, ARCHIVE)
+		JOURNAL.finish("extract")
 
-	if args.rename:
-		execute_rename(UNPACK_PATH, RENAME_TARGET_PATH)
+	if should_run("rename", args.rename):
+		with profiling.stage("rename"):
+			execute_rename(UNPACK_PATH, RENAME_TARGET_PATH, args.dedupe, JOURNAL, ARCHIVE)
+		JOURNAL.finish("rename")
 
-	if args.tidy:
-		execute_tidy(UNPACK_PATH, LEFT_FILES_PATH)
+	if should_run("tidy", args.tidy):
+		with profiling.stage("tidy"):
+			execute_tidy(UNPACK_PATH, LEFT_FILES_PATH, ARCHIVE, config['AssetRemainDir'])
+		JOURNAL.finish("tidy")
 
-	if args.gameconfig:
-		execute_gc_extract(RENAME_TARGET_PATH, JSON_DIR)
+	if should_run("gameconfig", args.gameconfig):
+		with profiling.stage("gameconfig"):
+			execute_gc_extract(RENAME_TARGET_PATH, JSON_DIR)
+		JOURNAL.finish("gameconfig")
 
-	if args.decompile:
-		decompile.recursive_decompile_dir(LUA_DIR)
\ No newline at end of file
+	if should_run("decompile", args.decompile):
+		with profiling.stage("decompile"):
+			decompile.recursive_decompile_dir(LUA_DIR)
+		JOURNAL.finish("decompile")
+
+	if should_run("index", args.index):
+		with profiling.stage("index"):
+			textindex.build_index(TEXT_INDEX_PATH, RENAME_TARGET_PATH, TEXT_INDEX_DIRS)
+		JOURNAL.finish("index")
+
+	if should_run("textures", args.textures):
+		print("Transcoding textures...")
+		with profiling.stage("textures"):
+			report = texture.transcode_all(RENAME_TARGET_PATH, TEXTURE_DIR, TEXTURE_CACHE_PATH, config.get('TextureFormat', 'webp'), ARCHIVE, [TEXTURE_DIR, UNPACK_PATH])
+		print(texture.format_report(report))
+		JOURNAL.finish("textures")
+
+	# the last flush of the journal commits the archive, so the journal has to be closed first
+	JOURNAL.close()
+	if ARCHIVE: ARCHIVE.close()
+
+
+if __name__ == "__main__":
+	# execute parser to allow easy commandline execution
+	parser = argparse.ArgumentParser()
+	add_arguments(parser)
+	run(parser.parse_args())
\ No newline at end of file
@@ -1,6 +1,8 @@
-from PIL import Image, ImageOps
 from pathlib import Path
 import os
+import argparse
+
+from lib.util import break_link
 
 CCZ_HEAD = bytes([0x43, 0x43, 0x5A, 0x21])
 
@@ -22,10 +24,13 @@ def apply_alpha(srcimg: Path):
 	command = f'TexturePacker "{pvr_alpha_path}" --sheet "{alpha_path}" --algorithm Basic --allow-free-size --trim-mode None'
 	os.system(command)
 
-	# load images and apply alpha channel to source image
+	# load images and apply alpha channel to source image, pillow is only imported once an image needs it
+	from PIL import Image
 	img = Image.open(srcimg)
 	imgalpha = Image.open(alpha_path)
 	img.putalpha(imgalpha.getchannel('A'))
+	# the png may be a hardlink of other assets, which must not change
+	break_link(srcimg.with_suffix('.png'))
 	img.save(srcimg.with_suffix('.png'))
 
 	# remove the leftover files
@@ -38,6 +43,15 @@ def recursive_apply_dir(src_dir: Path):
 	for img in src_dir.rglob('*.jpg'):
 		apply_alpha(img)
 
+def add_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('path', type=str, nargs='?', default=str(Path('Assets', 'asset')), help="Directory with the images to apply the alpha channels to.")
+
+def run(args: argparse.Namespace):
+	recursive_apply_dir(Path(args.path))
+
+
 if __name__ == "__main__":
-	ASSET_DIRECTORY = Path('Assets', 'asset')
-	recursive_apply_dir(ASSET_DIRECTORY)
\ No newline at end of file
+	# execute parser to allow easy commandline execution
+	parser = argparse.ArgumentParser()
+	add_arguments(parser)
+	run(parser.parse_args())
@@ -0,0 +1,46 @@
+import argparse
+from pathlib import Path
+
+from lib import Client
+from lib.packfile import PackArchive
+from lib.util import JsonConfig
+
+
+def main(client: Client, action: str, prefix: str = "", target: Path = None):
+	config = JsonConfig('config.json')
+	ASSET_DIR = Path(config['AssetDir'].format(client = client.locale_code))
+	PACK_DIR = Path(config['StateDir'].format(client = client.locale_code), config['PackDir'])
+	if not PACK_DIR.exists():
+		print(f"There is no asset archive at {PACK_DIR}.")
+		exit(1)
+
+	archive = PackArchive(PACK_DIR)
+	if action == "ls":
+		for path in archive.paths(prefix):
+			print(path)
+	elif action == "export":
+		print("Exporting archived assets...")
+		amount = archive.export(target or ASSET_DIR, prefix)
+		print(f"Exported {amount} files.")
+	elif action == "compact":
+		print("Compacting asset archive...")
+		reclaimed = archive.compact()
+		print(f"Reclaimed {reclaimed / 1024**2:.1f} MiB.")
+	archive.close()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('action', choices=['ls', 'export', 'compact'], help="ls lists the archived files, export writes them as a normal directory tree and compact removes unused data from the packs.")
+	parser.add_argument('-c', '--client', required=True, type=str, help="The client to apply the action to.")
+	parser.add_argument('-p', '--prefix', type=str, default="", help="Only list or export files whose path starts with the prefix.")
+	parser.add_argument('-o', '--output', type=str, help="Directory to export to. Defaults to the asset directory of the client.")
+
+def run(args: argparse.Namespace):
+	main(Client[args.client], args.action, args.prefix, Path(args.output) if args.output else None)
+
+
+if __name__ == "__main__":
+	# execute parser to allow easy commandline execution
+	parser = argparse.ArgumentParser(description="Manages the packed asset archive of a client.")
+	add_arguments(parser)
+	run(parser.parse_args())
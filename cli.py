@@ -0,0 +1,133 @@
+import sys
+import shlex
+import argparse
+import importlib
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+# all subcommands with the module that implements them and a short description.
+# the modules are only imported when their command gets executed, so all commands start up fast.
+# commands without module are implemented in this file.
+COMMANDS = {
+	"import": ("apk_import", "Imports all assets from an XAPK archive."),
+	"update": ("update", "Downloads and applies the newest updates and patches."),
+	"decrypt": (None, "Decrypts single files or directories."),
+	"convert": (None, "Converts a gameconfig database to json files."),
+	"decompile": (None, "Decompiles all lua files of a directory."),
+	"alpha": ("apply_image_alpha", "Applies the alpha channels to all images of a directory."),
+	"textures": ("transcode_textures", "Transcodes all png and jpg assets of a client into smaller lossless images."),
+	"search": ("search", "Searches the decompiled lua files and gameconfig json files of a client."),
+	"changelog": ("gameconfig_changelog", "Prints the row changes of the gameconfig between two indexed versions."),
+	"pack": ("asset_pack", "Manages the packed asset archive of a client."),
+	"repack": ("repack", "Encrypts a directory into update packs or patch files in the format of the game."),
+	"version": (None, "Prints the game and patch version of a client."),
+	"benchmark": (None, "Measures the start up time of commands."),
+}
+
+
+def add_decrypt_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('paths', type=str, nargs='+', help="Files or directories to decrypt.")
+	parser.add_argument('-o', '--output', type=str, help="Directory to write the decrypted files to. The files are decrypted in place if not given.")
+
+def run_decrypt(args: argparse.Namespace):
+	from lib import xxtea
+
+	for srcpath in map(Path, args.paths):
+		srcfiles = [srcpath] if srcpath.is_file() else [filepath for filepath in srcpath.rglob('*') if filepath.is_file()]
+		for srcfile in srcfiles:
+			if args.output:
+				relpath = srcfile.name if srcpath.is_file() else srcfile.relative_to(srcpath)
+				targetfile = Path(args.output, relpath)
+				targetfile.parent.mkdir(parents=True, exist_ok=True)
+			else:
+				targetfile = srcfile
+			xxtea.decrypt_file(srcfile, targetfile)
+
+
+def add_convert_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('database', type=str, help="Path to the gameconfig database.")
+	parser.add_argument('output', type=str, help="Directory to write the json files to.")
+	parser.add_argument('--decrypt', type=bool, default=True, action=argparse.BooleanOptionalAction, help="Sets whether the database gets decrypted before the conversion.")
+
+def run_convert(args: argparse.Namespace):
+	from lib import gameconfig
+
+	if args.decrypt:
+		gameconfig.decrypt_db(Path(args.database))
+	gameconfig.convert_db(Path(args.database), Path(args.output))
+
+
+def add_decompile_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('path', type=str, help="Directory with the compiled lua files.")
+	parser.add_argument('--pattern', type=str, default='*.luac', help="Search pattern of the files to decompile.")
+
+def run_decompile(args: argparse.Namespace):
+	from lib import decompile
+
+	decompile.recursive_decompile_dir(Path(args.path), args.pattern)
+
+
+def add_version_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('-c', '--client', required=True, type=str, help="The client to apply the action to.")
+
+def run_version(args: argparse.Namespace):
+	from lib import Client
+	from lib.util import JsonConfig
+
+	client = Client[args.client]
+	config = JsonConfig('config.json')
+	cocos_config = JsonConfig(Path(config['AssetDir'].format(client = client.locale_code), "cocos_app.conf"))
+	game_version = cocos_config.get('updJobId', cocos_config.get('packJobId'))
+	patch_version = cocos_config.get('patchJobId', game_version)
+	print(f"Client Version - Game: {game_version}, Patch: {patch_version}.")
+
+
+def add_benchmark_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('commands', type=str, nargs='*', help="Commands to measure, e.g. \"version -c EN\". Measures the help of all commands if not given.")
+	parser.add_argument('-n', '--runs', type=int, default=10, help="How often each command gets executed.")
+
+def run_benchmark(args: argparse.Namespace):
+	commands = args.commands or ["--help"] + [f"{command} --help" for command in COMMANDS]
+
+	def measure(cmdargs: list[str]) -> list[float]:
+		durations = []
+		for _ in range(args.runs):
+			start = time.perf_counter()
+			subprocess.run(cmdargs, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+			durations.append((time.perf_counter() - start) * 1000)
+		return durations
+
+	# the start up of the interpreter itself is the lower bound for every command
+	baseline = measure([sys.executable, "-c", "pass"])
+	print(f"{'python -c pass':<24} min {min(baseline):7.1f} ms   median {statistics.median(baseline):7.1f} ms")
+	for command in commands:
+		durations = measure([sys.executable, __file__, *shlex.split(command)])
+		print(f"{command:<24} min {min(durations):7.1f} ms   median {statistics.median(durations):7.1f} ms")
+
+
+def load_command(command: str):
+	modulename = COMMANDS[command][0]
+	if modulename is None:
+		return globals()[f"add_{command}_arguments"], globals()[f"run_{command}"]
+	module = importlib.import_module(modulename)
+	return module.add_arguments, module.run
+
+def main(argv: list[str]):
+	parser = argparse.ArgumentParser(description="Tools to import, update and decrypt the assets of Illusion Connect.")
+	subparsers = parser.add_subparsers(dest='command', required=True, metavar='COMMAND')
+	for command, (_, description) in COMMANDS.items():
+		subparser = subparsers.add_parser(command, help=description, description=description)
+		# only the arguments of the executed command are loaded
+		if argv and argv[0] == command:
+			add_arguments, run = load_command(command)
+			add_arguments(subparser)
+			subparser.set_defaults(run=run)
+
+	args = parser.parse_args(argv)
+	args.run(args)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,46 @@
+import argparse
+import json
+from pathlib import Path
+
+from lib import Client, gcindex
+from lib.util import JsonConfig
+
+
+def main(client: Client, old_version: int = None, new_version: int = None, outfile: Path = None):
+	config = JsonConfig('config.json')
+	STATE_DIR = Path(config['StateDir'].format(client = client.locale_code))
+	GAMECONFIG_INDEX_PATH = Path(STATE_DIR, "gameconfig_index.db")
+
+	indexed_versions = gcindex.versions(GAMECONFIG_INDEX_PATH)
+	if old_version is None or new_version is None:
+		print(f"Indexed versions: {', '.join(map(str, indexed_versions)) or 'None'}")
+		return
+
+	for version in (old_version, new_version):
+		if version not in indexed_versions:
+			print(f"Version {version} is not indexed.")
+			exit(1)
+
+	gc_changelog = gcindex.changelog(GAMECONFIG_INDEX_PATH, old_version, new_version)
+	if outfile:
+		with open(outfile, 'w', encoding='utf8') as f:
+			json.dump(gc_changelog, f, indent=4, ensure_ascii=False)
+	else:
+		print(json.dumps(gc_changelog, indent=4, ensure_ascii=False))
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('-c', '--client', required=True, type=str, help="The client to apply the action to.")
+	parser.add_argument('old', type=int, nargs='?', help="The version to compare from. Lists all indexed versions if not given.")
+	parser.add_argument('new', type=int, nargs='?', help="The version to compare to.")
+	parser.add_argument('-o', '--output', type=str, help="Writes the changelog to this file instead of the console.")
+
+def run(args: argparse.Namespace):
+	main(Client[args.client], args.old, args.new, Path(args.output) if args.output else None)
+
+
+if __name__ == "__main__":
+	# execute parser to allow easy commandline execution
+	parser = argparse.ArgumentParser(description="Prints the row changes of the gameconfig between two indexed versions.")
+	add_arguments(parser)
+	run(parser.parse_args())
@@ -2,6 +2,8 @@ from pathlib import Path
 import subprocess, sys
 import multiprocessing as mp
 
+from . import profiling
+
 
 LUA_COMPILED_HEAD = bytes([0x1B, 0x4C, 0x4A, 0x02])
 def is_lua_compiled(filepath: Path):
@@ -29,7 +31,8 @@ def decompile_lua_file(file_in: Path, file_out: Path):
 
 
 def recursive_decompile_dir(src_dir: Path, search_pattern: str = '*.luac'):
-	pool = mp.Pool(mp.cpu_count()-1)
+	initializer, initargs = profiling.pool_initializer("decompile")
+	pool = mp.Pool(mp.cpu_count()-1, initializer, initargs)
 	for luafile in src_dir.rglob(search_pattern):
 		targetfile = luafile.with_suffix('.lua')
 		pool.apply_async(decompile_lua_file, (luafile,targetfile,))
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import sqlite3
+from hashlib import blake2b, md5
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contents (
+	hash TEXT PRIMARY KEY,
+	size INTEGER NOT NULL,
+	used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS contents_used ON contents (used);
+CREATE TABLE IF NOT EXISTS total (
+	id INTEGER PRIMARY KEY CHECK (id = 0),
+	size INTEGER NOT NULL
+);
+"""
+
+
+def content_hash(data: bytes) -> str:
+	return blake2b(data, digest_size=16).hexdigest()
+
+def matches(data: bytes, size: Optional[int] = None, md5hash: Optional[str] = None) -> bool:
+	"""Checks the data against the size and md5 the server announced, if it announced them."""
+	if size is not None and len(data) != int(size): return False
+	if md5hash and md5(data).hexdigest() != md5hash.lower(): return False
+	return True
+
+def write_atomic(filepath: Path, data: bytes):
+	# other processes or machines sharing the directory never see a partially written file
+	filepath.parent.mkdir(parents=True, exist_ok=True)
+	temppath = filepath.with_name(f"{filepath.name}.{os.getpid()}.tmp")
+	with open(temppath, 'wb') as f:
+		f.write(data)
+	os.replace(temppath, filepath)
+
+
+class DownloadCache():
+	"""
+	Keeps downloaded cdn files in a plain directory, so they are not downloaded twice.
+
+	Every url path has a small key file with the size and hash of its content and
+	the content itself is stored once under its hash. Cached data is verified
+	against its size and hash before it is used and against the size and md5 the
+	server announces for the file, so a file replaced on the cdn is downloaded again.
+	The contents are recorded in a sqlite index together with their total size and
+	last use. If the total grows beyond max_size bytes, the least recently used
+	contents are removed. The directory can be shared between processes, as all
+	files are replaced atomically and the index is locked by sqlite.
+	"""
+	def __init__(self, root: os.PathLike, max_size: int):
+		self.root = Path(root)
+		self.max_size = max_size
+		self.root.mkdir(parents=True, exist_ok=True)
+		indexpath = Path(self.root, "index.db")
+		rebuild = not indexpath.exists()
+		self.conn = sqlite3.connect(str(indexpath), timeout=60)
+		self.conn.executescript(INDEX_SCHEMA)
+		if rebuild:
+			self.rebuild_index()
+
+	@staticmethod
+	def urlpath(fileurl: str) -> str:
+		# the same file has the same path on the cdn and the fallback cdn
+		return urlsplit(fileurl).path.lstrip("/")
+
+	def _keypath(self, fileurl: str) -> Path:
+		keyhash = blake2b(self.urlpath(fileurl).encode('utf8'), digest_size=16).hexdigest()
+		return Path(self.root, "keys", keyhash[:2], keyhash+".json")
+
+	def _datapath(self, datahash: str) -> Path:
+		return Path(self.root, "data", datahash[:2], datahash)
+
+	def rebuild_index(self):
+		"""Records all contents of the data directory in the index, e.g. for a cache written without index."""
+		with self.conn:
+			self.conn.execute("DELETE FROM contents")
+			for datapath in Path(self.root, "data").glob("*/*"):
+				if datapath.suffix == ".tmp": continue
+				try:
+					stat = datapath.stat()
+				except FileNotFoundError:
+					continue # removed by another process
+				self.conn.execute("INSERT OR REPLACE INTO contents VALUES (?, ?, ?)", (datapath.name, stat.st_size, stat.st_mtime))
+			self.conn.execute("REPLACE INTO total VALUES (0, (SELECT COALESCE(SUM(size), 0) FROM contents))")
+
+	def total_size(self) -> int:
+		row = self.conn.execute("SELECT size FROM total").fetchone()
+		return row[0] if row else 0
+
+	def _forget(self, datahash: str):
+		# keeps the running total in sync with the recorded contents
+		with self.conn:
+			row = self.conn.execute("SELECT size FROM contents WHERE hash=?", (datahash,)).fetchone()
+			if row is None: return
+			self.conn.execute("DELETE FROM contents WHERE hash=?", (datahash,))
+			self.conn.execute("UPDATE total SET size = size - ?", (row[0],))
+
+	def get(self, fileurl: str, size: Optional[int] = None, md5hash: Optional[str] = None) -> Optional[bytes]:
+		"""
+		Returns the cached content of the url, or None if it is not cached, invalid
+		or does not match the size and md5 the server announced for it.
+		"""
+		keypath = self._keypath(fileurl)
+		try:
+			with open(keypath, 'r', encoding='utf8') as f:
+				key = json.load(f)
+			datapath = self._datapath(key['hash'])
+			with open(datapath, 'rb') as f:
+				data = f.read()
+		except (OSError, ValueError, KeyError):
+			return None
+
+		if len(data) != key['size'] or content_hash(data) != key['hash']:
+			datapath.unlink(missing_ok=True)
+			keypath.unlink(missing_ok=True)
+			self._forget(key['hash'])
+			return None
+		if not matches(data, size, md5hash):
+			# the file was replaced on the cdn, the old content is evicted like any other
+			keypath.unlink(missing_ok=True)
+			return None
+		with self.conn:
+			self.conn.execute("UPDATE contents SET used=? WHERE hash=?", (time.time(), key['hash']))
+		return data
+
+	def put(self, fileurl: str, data: bytes):
+		datahash = content_hash(data)
+		datapath = self._datapath(datahash)
+		if not datapath.exists():
+			write_atomic(datapath, data)
+		with self.conn:
+			added = self.conn.execute("INSERT OR IGNORE INTO contents VALUES (?, ?, ?)", (datahash, len(data), time.time())).rowcount
+			if added:
+				self.conn.execute("UPDATE total SET size = size + ?", (len(data),))
+			else:
+				self.conn.execute("UPDATE contents SET used=? WHERE hash=?", (time.time(), datahash))
+		key = {"path": self.urlpath(fileurl), "size": len(data), "hash": datahash}
+		write_atomic(self._keypath(fileurl), json.dumps(key).encode('utf8'))
+		if self.total_size() > self.max_size:
+			self.evict()
+
+	def evict(self) -> int:
+		"""Removes the least recently used contents until the cache fits into max_size. Returns the amount of bytes removed."""
+		removed = 0
+		excess = self.total_size() - self.max_size
+		if excess <= 0: return removed
+		for datahash, size in self.conn.execute("SELECT hash, size FROM contents ORDER BY used").fetchall():
+			if removed >= excess: break
+			# key files of removed contents are dropped when they are read the next time
+			self._datapath(datahash).unlink(missing_ok=True)
+			self._forget(datahash)
+			removed += size
+		return removed
+
+	def close(self):
+		self.conn.close()
@@ -1,4 +1,4 @@
-import sqlite3, json
+import sqlite3, json, re, logging
 from pathlib import Path
 
 GLOBAL_KEY = "dpstorm.or.2019.07.24".encode('ascii')
@@ -32,16 +32,95 @@ def decrypt_db(dbpath: Path):
 	conn.close()
 
 
+REPLACE_QUERY_PATTERN = re.compile(r"^\s*(?:REPLACE|INSERT\s+OR\s+REPLACE)\s+INTO\s+[`\"\[]?(\w+)[`\"\]]?\s+VALUES\s*\(\s*('(?:[^']|'')*'|-?\d+)\s*,", re.IGNORECASE | re.DOTALL)
+DELETE_QUERY_PATTERN = re.compile(r"^\s*DELETE\s+FROM\s+[`\"\[]?(\w+)[`\"\]]?\s+WHERE\s+Id\s*=\s*('(?:[^']|'')*'|-?\d+)\s*$", re.IGNORECASE | re.DOTALL)
+TABLE_QUERY_PATTERN = re.compile(r"^\s*(?:(?:REPLACE|INSERT(?:\s+OR\s+\w+)?)\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+[`\"\[]?(\w+)", re.IGNORECASE)
+
+def split_sql_queries(sql_script: str):
+	"""
+	Splits a string of sql queries separated by semicolons into the single queries.
+	Semicolons inside of string literals do not end a query. Empty queries are skipped.
+	"""
+	query = ""
+	for fragment in sql_script.split(";"):
+		query += fragment
+		if not sqlite3.complete_statement(query + ";"):
+			query += ";"
+			continue
+		if query.strip():
+			yield query
+		query = ""
+	if query.rstrip(";").strip():
+		yield query.rstrip(";")
+
+def query_row_key(sql_query: str):
+	"""
+	Returns (tablename, row id) if the query replaces or deletes a whole row by its id, otherwise None.
+	"""
+	match = REPLACE_QUERY_PATTERN.match(sql_query) or DELETE_QUERY_PATTERN.match(sql_query)
+	if match:
+		return match.group(1), match.group(2)
+	return None
+
+def plan_merge_queries(sql_queries: list[str]):
+	"""
+	Removes all queries that are superseded by a later query on the same row.  
+	Queries that do not work on a single whole row are kept and executed in order,
+	no query before them is dropped because of a query after them.
+	"""
+	superseded = set()
+	last_query_index = {}
+	for i, sql_query in enumerate(sql_queries):
+		key = query_row_key(sql_query)
+		if key is None:
+			last_query_index.clear()
+			continue
+		if key in last_query_index:
+			superseded.add(last_query_index[key])
+		last_query_index[key] = i
+	return [sql_query for i, sql_query in enumerate(sql_queries) if i not in superseded]
+
 def merge_db(default_db_path: Path, merger_db_path: Path):
-	conn = sqlite3.connect(str(default_db_path))
-	conn.execute("ATTACH DATABASE ? AS new", (str(merger_db_path),))
-	cursor = conn.execute("SELECT * FROM new.sql")
-	for _, replace_sql_query in cursor.fetchall():
-		for sql_query in replace_sql_query.split(";"):
-			conn.execute(sql_query)
-		conn.commit()
-	conn.close()
+	"""
+	Applies all queries of the sql table of the merger database to the default database.
+
+	The merge runs in a single transaction, so a failed merge leaves the default database
+	unchanged. The merger database is only deleted after a successful merge.  
+	Returns a dict with the amount of rows touched per table.
+	"""
+	conn = sqlite3.connect(str(default_db_path), isolation_level=None, cached_statements=1024)
+	try:
+		conn.execute("PRAGMA journal_mode=MEMORY")
+		conn.execute("PRAGMA synchronous=OFF")
+		conn.execute("ATTACH DATABASE ? AS new", (str(merger_db_path),))
+
+		sql_queries = []
+		for _, replace_sql_query in conn.execute("SELECT * FROM new.sql"):
+			sql_queries.extend(split_sql_queries(replace_sql_query))
+		query_count = len(sql_queries)
+		sql_queries = plan_merge_queries(sql_queries)
+		logging.debug(f"Merging {len(sql_queries)} queries, {query_count-len(sql_queries)} superseded queries skipped.")
+
+		rows_touched = {}
+		conn.execute("BEGIN")
+		try:
+			for sql_query in sql_queries:
+				cursor = conn.execute(sql_query)
+				if match := TABLE_QUERY_PATTERN.match(sql_query):
+					tablename = match.group(1)
+					rows_touched[tablename] = rows_touched.get(tablename, 0) + max(cursor.rowcount, 0)
+			conn.execute("COMMIT")
+		except:
+			conn.execute("ROLLBACK")
+			raise
+		conn.execute("DETACH DATABASE new")
+	finally:
+		conn.close()
+
 	merger_db_path.unlink()
+	for tablename, rowcount in rows_touched.items():
+		logging.debug(f"Merged {rowcount} rows into {tablename}.")
+	return rows_touched
 
 
 def convert_table(cursor, tablename: str, targetdir: Path):
@@ -0,0 +1,142 @@
+import sqlite3
+from hashlib import blake2b
+from pathlib import Path
+from typing import Optional
+
+ROW_HASH_SIZE = 8
+COLUMN_HASH_SIZE = 4
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS columns (
+	version INTEGER NOT NULL,
+	tablename TEXT NOT NULL,
+	columns TEXT NOT NULL,
+	PRIMARY KEY (version, tablename)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rows (
+	version INTEGER NOT NULL,
+	tablename TEXT NOT NULL,
+	row_id TEXT NOT NULL,
+	rowhash BLOB NOT NULL,
+	columnhashes BLOB NOT NULL,
+	PRIMARY KEY (version, tablename, row_id)
+) WITHOUT ROWID;
+"""
+
+
+def hash_bytes(data: str, size: int) -> bytes:
+	return blake2b(data.encode('utf8'), digest_size=size).digest()
+
+def open_index(indexpath: Path) -> sqlite3.Connection:
+	indexpath.parent.mkdir(parents=True, exist_ok=True)
+	conn = sqlite3.connect(str(indexpath))
+	conn.executescript(INDEX_SCHEMA)
+	return conn
+
+
+def index_db(dbpath: Path, indexpath: Path, version: int):
+	"""
+	Stores a hash of every row and every column of the decrypted gameconfig database
+	at dbpath as the given version in the index. An existing index of that version is replaced.
+	"""
+	db = sqlite3.connect(str(dbpath))
+	conn = open_index(indexpath)
+	with conn:
+		conn.execute("DELETE FROM columns WHERE version=?", (version,))
+		conn.execute("DELETE FROM rows WHERE version=?", (version,))
+
+		tables = db.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+		for (tablename,) in tables:
+			columns = db.execute(f"SELECT * FROM {tablename} WHERE Id='Id'").fetchone()
+			if columns is None: continue
+			conn.execute("INSERT INTO columns VALUES (?, ?, ?)", (version, tablename, columns[1]))
+
+			cursor = db.execute(f"SELECT * FROM {tablename} WHERE Id NOT IN (?, ?)", ('Id', 'DataType'))
+			conn.executemany("INSERT INTO rows VALUES (?, ?, ?, ?, ?)", (
+				(
+					version, tablename, str(row_index), hash_bytes(data, ROW_HASH_SIZE),
+					b''.join(hash_bytes(content, COLUMN_HASH_SIZE) for content in data.split("#@#"))
+				)
+				for row_index, data in cursor
+			))
+	conn.close()
+	db.close()
+
+def versions(indexpath: Path) -> list[int]:
+	conn = open_index(indexpath)
+	result = [version for (version,) in conn.execute("SELECT DISTINCT version FROM columns ORDER BY version")]
+	conn.close()
+	return result
+
+def latest_version(indexpath: Path) -> Optional[int]:
+	indexed_versions = versions(indexpath)
+	if indexed_versions:
+		return indexed_versions[-1]
+	return None
+
+def prune(indexpath: Path, keep: int) -> list[int]:
+	"""Removes all but the keep newest versions from the index, keep 0 keeps all versions. Returns the removed versions."""
+	removed = versions(indexpath)[:-keep] if keep > 0 else []
+	conn = open_index(indexpath)
+	with conn:
+		for version in removed:
+			conn.execute("DELETE FROM columns WHERE version=?", (version,))
+			conn.execute("DELETE FROM rows WHERE version=?", (version,))
+	conn.close()
+	return removed
+
+
+def split_columnhashes(columns: str, columnhashes: bytes) -> dict[str, bytes]:
+	return {
+		column: columnhashes[i*COLUMN_HASH_SIZE:(i+1)*COLUMN_HASH_SIZE]
+		for i, column in enumerate(columns.split("#@#"))
+	}
+
+def changelog(indexpath: Path, old_version: int, new_version: int) -> dict:
+	"""
+	Compares the row hashes of two indexed versions.
+
+	Returns a dict of all changed tables, each containing the ids of added and
+	removed rows and a dict of the modified rows with their changed columns.
+	"""
+	conn = open_index(indexpath)
+	result = {}
+	def tablelog(tablename):
+		if tablename not in result:
+			result[tablename] = {"added": [], "removed": [], "modified": {}}
+		return result[tablename]
+
+	# rows that only exist in one of both versions
+	only_in_query = """
+		SELECT a.tablename, a.row_id FROM rows a
+		LEFT JOIN rows b ON b.version=? AND b.tablename=a.tablename AND b.row_id=a.row_id
+		WHERE a.version=? AND b.row_id IS NULL
+		ORDER BY a.tablename, a.row_id
+	"""
+	for tablename, row_id in conn.execute(only_in_query, (old_version, new_version)):
+		tablelog(tablename)["added"].append(row_id)
+	for tablename, row_id in conn.execute(only_in_query, (new_version, old_version)):
+		tablelog(tablename)["removed"].append(row_id)
+
+	# rows that exist in both versions, but with different content
+	columns = {}
+	for version, tablename, columnnames in conn.execute("SELECT * FROM columns WHERE version IN (?, ?)", (old_version, new_version)):
+		columns[(version, tablename)] = columnnames
+
+	modified_query = """
+		SELECT a.tablename, a.row_id, a.columnhashes, b.columnhashes FROM rows a
+		JOIN rows b ON b.version=? AND b.tablename=a.tablename AND b.row_id=a.row_id
+		WHERE a.version=? AND a.rowhash != b.rowhash
+		ORDER BY a.tablename, a.row_id
+	"""
+	for tablename, row_id, old_hashes, new_hashes in conn.execute(modified_query, (new_version, old_version)):
+		old_columns = split_columnhashes(columns[(old_version, tablename)], old_hashes)
+		new_columns = split_columnhashes(columns[(new_version, tablename)], new_hashes)
+		changed_columns = [
+			column for column in sorted(old_columns.keys() | new_columns.keys())
+			if old_columns.get(column) != new_columns.get(column)
+		]
+		tablelog(tablename)["modified"][row_id] = changed_columns
+
+	conn.close()
+	return result
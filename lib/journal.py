@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import sqlite3
+from pathlib import Path
+from typing import Any, Optional
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+	name TEXT PRIMARY KEY,
+	done INTEGER NOT NULL DEFAULT 0,
+	data TEXT
+);
+CREATE TABLE IF NOT EXISTS members (
+	stage TEXT NOT NULL,
+	member TEXT NOT NULL,
+	value TEXT,
+	PRIMARY KEY (stage, member)
+) WITHOUT ROWID;
+"""
+
+
+def stage_condition(column: str, stage: str) -> tuple[str, tuple]:
+	"""Returns an sql condition with its parameters, that matches the stage and all stages it contains, or all stages if stage is empty."""
+	if not stage:
+		return "1", ()
+	return f"({column}=? OR substr({column}, 1, ?)=?)", (stage, len(stage)+1, stage+":")
+
+
+class Journal():
+	"""
+	Records the progress of a long running process at stage and member granularity,
+	so an interrupted run can be resumed where it stopped. Stage names are separated
+	by colons into levels, e.g. the stage "apply:5" contains the stage "apply:5:commit".
+
+	Marked members are only written to disk in batches of batch_size members or
+	after batch_interval seconds, whichever comes first. Finishing a stage always writes
+	all pending members. After a crash at most one batch of members is done again.
+	"""
+	def __init__(self, path: os.PathLike, batch_size: int = 1000, batch_interval: float = 5.0):
+		self.path = Path(path)
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		self.conn = sqlite3.connect(str(self.path))
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("PRAGMA synchronous=FULL")
+		self.conn.executescript(JOURNAL_SCHEMA)
+		self.batch_size = batch_size
+		self.batch_interval = batch_interval
+		self.pending = []
+		self.last_flush = time.monotonic()
+		# called before marked members are written, to persist the data they refer to first
+		self.before_flush = []
+
+	def begin(self, stage: str, data: Any = None):
+		"""Starts a stage with optional json serializable data, unless it was already started."""
+		with self.conn:
+			self.conn.execute("INSERT OR IGNORE INTO stages (name, data) VALUES (?, ?)", (stage, json.dumps(data)))
+
+	def is_started(self, stage: str) -> bool:
+		return self.conn.execute("SELECT 1 FROM stages WHERE name=?", (stage,)).fetchone() is not None
+
+	def is_done(self, stage: str) -> bool:
+		row = self.conn.execute("SELECT done FROM stages WHERE name=?", (stage,)).fetchone()
+		return bool(row and row[0])
+
+	def stage_data(self, stage: str) -> Any:
+		row = self.conn.execute("SELECT data FROM stages WHERE name=?", (stage,)).fetchone()
+		if row is None: return None
+		return json.loads(row[0])
+
+	def unfinished(self, stage: str = "") -> dict[str, Any]:
+		"""Returns a dict of all started but not finished stages contained in the stage, with their data."""
+		condition, params = stage_condition("name", stage)
+		rows = self.conn.execute(f"SELECT name, data FROM stages WHERE done=0 AND {condition}", params)
+		return {name: json.loads(data) for name, data in rows}
+
+	def finish(self, stage: str):
+		self.flush()
+		with self.conn:
+			self.conn.execute("INSERT OR IGNORE INTO stages (name) VALUES (?)", (stage,))
+			self.conn.execute("UPDATE stages SET done=1 WHERE name=?", (stage,))
+
+	def mark(self, stage: str, member: str, value: Optional[str] = None):
+		"""Marks a member of the stage as done, with an optional value to remember."""
+		self.pending.append((stage, member, value))
+		if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.batch_interval:
+			self.flush()
+
+	def flush(self):
+		for callback in self.before_flush:
+			callback()
+		if self.pending:
+			with self.conn:
+				self.conn.executemany("INSERT OR REPLACE INTO members VALUES (?, ?, ?)", self.pending)
+			self.pending = []
+		self.last_flush = time.monotonic()
+
+	def done_members(self, stage: str) -> dict[str, Optional[str]]:
+		"""Returns a dict of all marked members of the stage with their values."""
+		self.flush()
+		return dict(self.conn.execute("SELECT member, value FROM members WHERE stage=?", (stage,)))
+
+	def clear(self, stage: str = ""):
+		"""Removes the stage and all stages it contains, or all stages if no stage is given."""
+		self.flush()
+		with self.conn:
+			condition, params = stage_condition("name", stage)
+			self.conn.execute(f"DELETE FROM stages WHERE {condition}", params)
+			condition, params = stage_condition("stage", stage)
+			self.conn.execute(f"DELETE FROM members WHERE {condition}", params)
+
+	def close(self):
+		self.flush()
+		self.conn.close()
@@ -0,0 +1,191 @@
+import os
+import mmap
+import sqlite3
+from hashlib import blake2b
+from pathlib import Path
+from typing import Iterator, Optional
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+	path TEXT PRIMARY KEY,
+	pack INTEGER NOT NULL,
+	offset INTEGER NOT NULL,
+	length INTEGER NOT NULL,
+	hash BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_hash ON entries (hash);
+"""
+
+# paths that are processed further by other tools and always stay as normal files
+UNPACKED_PATHS = ('script/', 'gameConfig.db', 'gameUpdateConfig.db', 'cocos_app.conf')
+
+def is_unpacked(path: str) -> bool:
+	return path.startswith(UNPACKED_PATHS)
+
+
+class PackArchive():
+	"""
+	Stores many small files in a few append-only pack files.
+
+	The index maps every logical path to the pack, offset, length and hash of its data,
+	sorted by path. Files with the same content share their data. Replaced and deleted
+	files leave their data inside the packs until the archive is compacted.
+	"""
+	def __init__(self, root: os.PathLike, max_pack_size: int = 2**30):
+		self.root = Path(root)
+		self.root.mkdir(parents=True, exist_ok=True)
+		self.max_pack_size = max_pack_size
+		self.conn = sqlite3.connect(str(Path(self.root, "index.db")))
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.executescript(INDEX_SCHEMA)
+		self.maps = {}
+		self.writer = None
+		self.writer_pack = None
+
+	def _packpath(self, pack: int) -> Path:
+		return Path(self.root, f"pack-{pack:05d}.dat")
+
+	def _packs(self) -> list[int]:
+		return sorted(int(packpath.stem.split("-")[1]) for packpath in self.root.glob("pack-*.dat"))
+
+	@staticmethod
+	def hash(data: bytes) -> bytes:
+		return blake2b(data, digest_size=16).digest()
+
+
+	# writing
+	def _append(self, data: bytes) -> tuple[int, int]:
+		if self.writer is None or self.writer.tell() + len(data) > self.max_pack_size and self.writer.tell() > 0:
+			if self.writer: self.writer.close()
+			packs = self._packs()
+			self.writer_pack = packs[-1] if packs else 0
+			if packs and self._packpath(self.writer_pack).stat().st_size + len(data) > self.max_pack_size:
+				self.writer_pack += 1
+			self.writer = open(self._packpath(self.writer_pack), 'ab')
+		offset = self.writer.tell()
+		self.writer.write(data)
+		return self.writer_pack, offset
+
+	def write(self, path: str, data: bytes):
+		"""Stores data at the logical path, replacing an existing file."""
+		datahash = self.hash(data)
+		location = self.conn.execute("SELECT pack, offset FROM entries WHERE hash=? AND length=? LIMIT 1", (datahash, len(data))).fetchone()
+		if location is None:
+			location = self._append(data)
+		self.conn.execute("REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", (path, *location, len(data), datahash))
+
+	def link(self, path: str, targetpath: str) -> bool:
+		"""Makes targetpath share the data of path. Returns False if path does not exist."""
+		cursor = self.conn.execute("REPLACE INTO entries SELECT ?, pack, offset, length, hash FROM entries WHERE path=?", (targetpath, path))
+		return cursor.rowcount > 0
+
+	def rename(self, path: str, targetpath: str) -> bool:
+		"""Moves a file to targetpath. Returns False if path does not exist."""
+		if not self.link(path, targetpath): return False
+		self.delete(path)
+		return True
+
+	def delete(self, path: str):
+		self.conn.execute("DELETE FROM entries WHERE path=?", (path,))
+
+	def commit(self):
+		if self.writer:
+			self.writer.flush()
+			os.fsync(self.writer.fileno())
+		self.conn.commit()
+
+
+	# reading
+	def exists(self, path: str) -> bool:
+		return self.conn.execute("SELECT 1 FROM entries WHERE path=?", (path,)).fetchone() is not None
+
+	def paths(self, prefix: str = "") -> Iterator[str]:
+		"""Iterates over all logical paths starting with prefix in sorted order."""
+		cursor = self.conn.execute("SELECT path FROM entries WHERE substr(path, 1, ?)=? ORDER BY path", (len(prefix), prefix))
+		return (path for (path,) in cursor.fetchall())
+
+	@staticmethod
+	def _unmap(packmap: mmap.mmap):
+		try:
+			packmap.close()
+		except BufferError:
+			# memoryviews returned by read still use the map, it is unmapped once they are released
+			pass
+
+	def _map(self, pack: int, end: int) -> mmap.mmap:
+		packmap = self.maps.get(pack)
+		if packmap is None or len(packmap) < end:
+			if self.writer and self.writer_pack == pack:
+				self.writer.flush()
+			if packmap: self._unmap(packmap)
+			with open(self._packpath(pack), 'rb') as f:
+				packmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			self.maps[pack] = packmap
+		return packmap
+
+	def read(self, path: str) -> Optional[memoryview]:
+		"""
+		Returns the data of the file without copying it out of the pack, or None if it does not exist.
+		The view stays valid even if the archive is remapped, compacted or closed.
+		"""
+		location = self.conn.execute("SELECT pack, offset, length FROM entries WHERE path=?", (path,)).fetchone()
+		if location is None: return None
+		pack, offset, length = location
+		if length == 0: return memoryview(b'')
+		return memoryview(self._map(pack, offset + length))[offset:offset+length]
+
+
+	# maintenance
+	def export(self, target_dir: Path, prefix: str = "") -> int:
+		"""Writes all files starting with prefix as normal files into target_dir. Returns the amount of files."""
+		amount = 0
+		for path in self.paths(prefix):
+			targetpath = Path(target_dir, path)
+			targetpath.parent.mkdir(parents=True, exist_ok=True)
+			with open(targetpath, 'wb') as f:
+				f.write(self.read(path))
+			amount += 1
+		return amount
+
+	def compact(self) -> int:
+		"""
+		Rewrites all referenced data into new packs and deletes the old ones.
+		Returns the amount of bytes reclaimed.
+		"""
+		self.commit()
+		old_packs = self._packs()
+		old_size = sum(self._packpath(pack).stat().st_size for pack in old_packs)
+
+		# start a new pack, so no old pack is appended to
+		if self.writer: self.writer.close()
+		self.writer_pack = (old_packs[-1] + 1) if old_packs else 0
+		self.writer = open(self._packpath(self.writer_pack), 'ab')
+
+		locations = self.conn.execute("SELECT DISTINCT pack, offset, length FROM entries ORDER BY pack, offset").fetchall()
+		for pack, offset, length in locations:
+			data = self.read_location(pack, offset, length)
+			new_pack, new_offset = self._append(data)
+			self.conn.execute("UPDATE entries SET pack=?, offset=? WHERE pack=? AND offset=? AND length=?", (new_pack, new_offset, pack, offset, length))
+		self.commit()
+
+		for packmap in self.maps.values():
+			self._unmap(packmap)
+		self.maps = {}
+		for pack in old_packs:
+			self._packpath(pack).unlink()
+		new_size = sum(self._packpath(pack).stat().st_size for pack in self._packs())
+		return old_size - new_size
+
+	def read_location(self, pack: int, offset: int, length: int) -> bytes:
+		if length == 0: return b''
+		return bytes(self._map(pack, offset + length)[offset:offset+length])
+
+	def close(self):
+		self.commit()
+		if self.writer:
+			self.writer.close()
+			self.writer = None
+		for packmap in self.maps.values():
+			self._unmap(packmap)
+		self.maps = {}
+		self.conn.close()
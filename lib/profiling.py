@@ -0,0 +1,173 @@
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Optional
+
+# the profiling modules are only imported once profiling is enabled, so disabled stages cost nothing
+TOP_ALLOCATIONS = 25
+
+# the profiler is disabled as long as there is no output directory
+output_dir: Optional[Path] = None
+stage_counter = 0
+active_stages = []
+
+
+class StageRecord():
+	def __init__(self):
+		import cProfile
+		self.profile = cProfile.Profile()
+		self.peak_memory = 0
+		self.peak_rss = 0
+
+
+def enable(directory: os.PathLike):
+	"""Enables profiling of all stages, the results are written into directory."""
+	global output_dir
+	output_dir = Path(directory)
+	output_dir.mkdir(parents=True, exist_ok=True)
+
+def peak_rss() -> tuple[Optional[int], Optional[int]]:
+	"""
+	Returns the peak resident set size in bytes of this process and of all finished child processes,
+	both over the whole lifetime of the process.
+	"""
+	try:
+		import resource
+	except ImportError:
+		return None, None # not available on windows
+	# linux reports kibibytes, macos bytes
+	scale = 1 if sys.platform == 'darwin' else 1024
+	return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+		resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+def reset_peak_rss() -> bool:
+	"""Resets the peak resident set size of this process, which is only possible on linux. Returns whether it was reset."""
+	try:
+		with open("/proc/self/clear_refs", 'w') as f:
+			f.write("5")
+		return True
+	except OSError:
+		return False
+
+def peak_rss_since_reset() -> int:
+	"""Returns the peak resident set size in bytes of this process since the last reset_peak_rss, 0 if it is unknown."""
+	try:
+		with open("/proc/self/status", 'r') as f:
+			for line in f:
+				if line.startswith("VmHWM:"):
+					return int(line.split()[1]) * 1024
+	except OSError:
+		pass
+	return 0
+
+def format_size(size: Optional[int]) -> str:
+	return "n/a" if size is None else f"{size / 1024**2:.1f} MiB"
+
+
+def stage(name: str):
+	"""
+	Profiles the cpu time and memory of everything executed inside the returned context.
+	Does nothing if profiling is not enabled.
+	"""
+	if output_dir is None:
+		return nullcontext()
+	return profile_stage(name)
+
+@contextmanager
+def profile_stage(name: str):
+	import tracemalloc
+	global stage_counter
+	stage_counter += 1
+	filename = f"{stage_counter:02d}_{name.replace(' ', '_').replace(':', '_')}"
+
+	# only one profile can run at a time, so an enclosing stage pauses while a nested stage runs
+	record = StageRecord()
+	if active_stages:
+		outer = active_stages[-1]
+		outer.profile.disable()
+		outer.peak_memory = max(outer.peak_memory, tracemalloc.get_traced_memory()[1])
+		outer.peak_rss = max(outer.peak_rss, peak_rss_since_reset())
+	active_stages.append(record)
+	started_tracing = not tracemalloc.is_tracing()
+	if started_tracing:
+		tracemalloc.start()
+	tracemalloc.reset_peak()
+	# the peak rss can only be measured per stage if it can be reset
+	rss_resettable = reset_peak_rss()
+
+	start = time.perf_counter()
+	record.profile.enable()
+	try:
+		yield
+	finally:
+		record.profile.disable()
+		duration = time.perf_counter() - start
+		record.peak_memory = max(record.peak_memory, tracemalloc.get_traced_memory()[1])
+		record.peak_rss = max(record.peak_rss, peak_rss_since_reset())
+		snapshot = tracemalloc.take_snapshot().filter_traces((
+			tracemalloc.Filter(False, tracemalloc.__file__),
+			tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+			tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+		))
+		if started_tracing:
+			tracemalloc.stop()
+		active_stages.pop()
+
+		record.profile.dump_stats(Path(output_dir, filename+".prof"))
+		with open(Path(output_dir, filename+".alloc.txt"), 'w', encoding='utf8') as f:
+			f.write(f"Top {TOP_ALLOCATIONS} allocation sites still allocated at the end of {name}:\n")
+			for statistic in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+				f.write(f"{statistic}\n")
+
+		rss, children_rss = peak_rss()
+		# the peak of the child processes can not be reset, so it always covers the whole lifetime
+		if rss_resettable:
+			rss_summary = f"peak rss {format_size(record.peak_rss)}"
+		else:
+			rss_summary = f"peak rss of the process so far {format_size(rss)}"
+		summary = (f"{name}: {duration:.2f}s, peak traced memory {format_size(record.peak_memory)}, "
+			f"{rss_summary}, peak rss of all child processes so far {format_size(children_rss)}")
+		with open(Path(output_dir, "summary.txt"), 'a', encoding='utf8') as f:
+			f.write(summary+"\n")
+		print(f"[profile] {summary}")
+
+		if active_stages:
+			outer = active_stages[-1]
+			outer.peak_memory = max(outer.peak_memory, record.peak_memory)
+			tracemalloc.reset_peak()
+			outer.peak_rss = max(outer.peak_rss, record.peak_rss)
+			reset_peak_rss()
+			outer.profile.enable()
+
+
+# pool workers
+def pool_initializer(name: str, initializer=None, initargs: tuple = ()) -> tuple:
+	"""
+	Returns the initializer and its arguments for a pool whose workers should be profiled.
+	The own initializer of the pool, if any, is called by the returned one.
+	"""
+	if output_dir is None:
+		return initializer, initargs
+	return init_worker, (output_dir, name, initializer, initargs)
+
+def init_worker(directory: Path, name: str, initializer=None, initargs: tuple = ()):
+	import cProfile
+	import tracemalloc
+	import multiprocessing.util
+
+	# forked workers inherit the profile and memory tracing of the stage that started them
+	sys.setprofile(None)
+	if tracemalloc.is_tracing():
+		tracemalloc.stop()
+
+	profile = cProfile.Profile()
+	def dump_profile():
+		profile.disable()
+		profile.dump_stats(Path(directory, f"{name}_worker{os.getpid()}.prof"))
+	# the workers dump their profile when the pool is closed and joined
+	multiprocessing.util.Finalize(profile, dump_profile, exitpriority=10)
+	profile.enable()
+	if initializer is not None:
+		initializer(*initargs)
@@ -0,0 +1,102 @@
+import json
+import multiprocessing
+from hashlib import blake2b, md5
+from pathlib import Path
+from typing import Optional
+from zipfile import ZipFile, ZIP_STORED
+
+from . import xxtea, profiling
+
+
+def is_lua_path(assetpath: str) -> bool:
+	return assetpath.endswith(('.lua', '.luac'))
+
+def member_name(assetpath: str) -> str:
+	"""Name of the encrypted file of an asset inside an update pack."""
+	return blake2b(assetpath.encode('utf8'), digest_size=16).hexdigest()
+
+def encrypt_asset(task: tuple[Path, str, int]) -> tuple[str, bytes]:
+	src_dir, assetpath, encrypt_len = task
+	with open(Path(src_dir, assetpath), 'rb') as f:
+		data = f.read()
+	return assetpath, xxtea.encrypt(data, is_lua_path(assetpath), encrypt_len)
+
+def encrypt_assets(src_dir: Path, assetpaths: list[str], processes: int = None, chunksize: int = 16, encrypt_len: int = None):
+	"""Encrypts the assets in parallel and yields (assetpath, encrypted data) in the given order."""
+	tasks = [(src_dir, assetpath, encrypt_len) for assetpath in assetpaths]
+	initializer, initargs = profiling.pool_initializer("encrypt")
+	with multiprocessing.Pool(processes, initializer, initargs) as pool:
+		yield from pool.imap(encrypt_asset, tasks, chunksize)
+		# let the workers exit on their own, so profiled workers can write their results
+		pool.close()
+		pool.join()
+
+
+def build_update_pack(packpath: Path, version: int, encrypted_assets, deleted_assets: Optional[list[str]] = None) -> int:
+	"""
+	Writes an update pack that extrack_update_pack can apply.
+
+	The info file starts with the target version, followed by a line with the
+	amount of entries and one json line per asset. The two last values of an
+	entry are the size and md5 of the encrypted data, which the updater ignores.
+	Deleted assets get an empty member name.
+	Returns the amount of bytes written into the pack.
+	"""
+	if deleted_assets is None:
+		deleted_assets = []
+	info_lines = []
+	written = 0
+	with ZipFile(packpath, 'w', ZIP_STORED) as update_archive:
+		for assetpath, encrypted_data in encrypted_assets:
+			dbpath = member_name(assetpath)
+			update_archive.writestr(dbpath, encrypted_data)
+			info_lines.append(json.dumps([assetpath, dbpath, len(encrypted_data), md5(encrypted_data).hexdigest()]))
+			written += len(encrypted_data)
+		for assetpath in deleted_assets:
+			info_lines.append(json.dumps([assetpath, "", 0, ""]))
+		update_info = "\n".join([f"version:{version}", str(len(info_lines))] + info_lines)
+		update_archive.writestr('update', update_info.encode('utf8'))
+	return written
+
+def write_patch_files(target_dir: Path, encrypted_assets) -> int:
+	"""Writes the encrypted assets as single patch files. Returns the amount of bytes written."""
+	written = 0
+	for assetpath, encrypted_data in encrypted_assets:
+		targetpath = Path(target_dir, assetpath)
+		targetpath.parent.mkdir(parents=True, exist_ok=True)
+		with open(targetpath, 'wb') as f:
+			f.write(encrypted_data)
+		written += len(encrypted_data)
+	return written
+
+
+def version_check_response(cdn_url: str, target_version: int, pack_urls: Optional[list[str]] = None,
+							patch_version: int = None, patch_files: Optional[list[tuple[str, str]]] = None) -> dict:
+	"""
+	Builds a version check response in the format the server sends.
+
+	The response announces an update if pack urls are given, otherwise a patch
+	with the (url, assetpath) tuples of patch_files.
+	"""
+	if pack_urls is None:
+		pack_urls = []
+	if patch_files is None:
+		patch_files = []
+	if patch_version is None:
+		patch_version = target_version
+	return {
+		"status": 0,
+		"data": {
+			"ret": 1 if pack_urls else 0,
+			"data": {
+				"targetV": target_version,
+				"cdnUrl": cdn_url,
+				"extraCdnUrl": cdn_url,
+				"pack": {"1": {"64": [{"url": url} for url in pack_urls]}} if pack_urls else {},
+				"patchInfo": {
+					"patchVersion": patch_version,
+					"patch": {"64": [{"url": url, "logic": assetpath} for url, assetpath in patch_files]},
+				},
+			},
+		},
+	}
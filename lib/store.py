@@ -0,0 +1,75 @@
+import os
+from hashlib import blake2b
+from pathlib import Path
+from typing import Callable, Optional
+
+from . import util
+
+
+class ContentStore():
+	"""
+	Content-addressed store for decrypted assets, shared by all clients.
+
+	Decrypted files are kept as blobs named by the hash of their content. Additionally
+	the hash of the encrypted source data is linked to its blob, so files that are already
+	inside the store do not need to be decrypted again. Asset paths are linked to the blobs.
+	"""
+	def __init__(self, root: os.PathLike):
+		self.root = Path(root)
+		self.blobdir = Path(self.root, "blobs")
+		self.srcdir = Path(self.root, "src")
+
+	@staticmethod
+	def hash(data: bytes) -> str:
+		return blake2b(data, digest_size=20).hexdigest()
+
+	@staticmethod
+	def _hashpath(parentdir: Path, digest: str) -> Path:
+		return Path(parentdir, digest[:2], digest)
+
+	def lookup(self, src_data: bytes) -> Optional[Path]:
+		"""Returns the blob of the decrypted content of the encrypted source data if it is stored."""
+		srcpath = self._hashpath(self.srcdir, self.hash(src_data))
+		if srcpath.exists():
+			return srcpath
+		return None
+
+	def put(self, src_data: bytes, data: bytes) -> Path:
+		"""Stores the decrypted data and remembers it as the content of the encrypted source data."""
+		blobpath = self._hashpath(self.blobdir, self.hash(data))
+		if not blobpath.exists():
+			util.mkdirs(blobpath)
+			# write to a temporary file first, so a blob is never seen half written
+			temppath = blobpath.with_name(f"{blobpath.name}.{os.getpid()}.tmp")
+			with open(temppath, 'wb') as f:
+				f.write(data)
+			os.replace(temppath, blobpath)
+
+		srcpath = self._hashpath(self.srcdir, self.hash(src_data))
+		if not srcpath.exists():
+			util.mkdirs(srcpath)
+			# link to a temporary file first, other processes must never see an empty or half copied file
+			temppath = srcpath.with_name(f"{srcpath.name}.{os.getpid()}.tmp")
+			temppath.unlink(missing_ok=True)
+			util.link_or_copy(blobpath, temppath)
+			os.replace(temppath, srcpath)
+			# renaming a hardlink onto another link of the same blob does nothing and keeps the temporary file
+			temppath.unlink(missing_ok=True)
+		return blobpath
+
+	def materialize(self, src_data: bytes, targetpath: Path, decrypt: Callable[[bytes], bytes]) -> bool:
+		"""
+		Links targetpath to the decrypted content of the encrypted source data.
+		The data is only decrypted and written if it is not already inside the store.
+
+		Returns True if the data had to be decrypted.
+		"""
+		blobpath = self.lookup(src_data)
+		decrypted = blobpath is None
+		if decrypted:
+			blobpath = self.put(src_data, decrypt(src_data))
+
+		if targetpath.exists():
+			targetpath.unlink()
+		util.link_or_copy(blobpath, targetpath)
+		return decrypted
@@ -0,0 +1,115 @@
+import sqlite3
+from pathlib import Path, PurePosixPath
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+	id INTEGER PRIMARY KEY,
+	path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS trigrams (
+	trigram TEXT NOT NULL,
+	file INTEGER NOT NULL,
+	PRIMARY KEY (trigram, file)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS trigrams_file ON trigrams (file);
+"""
+
+
+def open_index(indexpath: Path) -> sqlite3.Connection:
+	indexpath.parent.mkdir(parents=True, exist_ok=True)
+	conn = sqlite3.connect(str(indexpath))
+	conn.execute("PRAGMA journal_mode=WAL")
+	conn.executescript(INDEX_SCHEMA)
+	return conn
+
+def text_trigrams(text: str) -> set[str]:
+	text = text.lower()
+	return {text[i:i+3] for i in range(len(text)-2)}
+
+def is_indexed_path(relpath: str, indexed_dirs: list[tuple[str, str]]) -> bool:
+	path = PurePosixPath(relpath)
+	for dirname, suffix in indexed_dirs:
+		if path.suffix == suffix and path.parts[0] == dirname:
+			return True
+	return False
+
+
+def remove_file(conn: sqlite3.Connection, relpath: str):
+	row = conn.execute("SELECT id FROM files WHERE path=?", (relpath,)).fetchone()
+	if row is None: return
+	conn.execute("DELETE FROM trigrams WHERE file=?", row)
+	conn.execute("DELETE FROM files WHERE id=?", row)
+
+def index_file(conn: sqlite3.Connection, root_dir: Path, relpath: str):
+	remove_file(conn, relpath)
+	filepath = Path(root_dir, relpath)
+	if not filepath.exists(): return
+
+	with open(filepath, 'r', encoding='utf8', errors='replace') as f:
+		trigrams = text_trigrams(f.read())
+	file_id = conn.execute("INSERT INTO files (path) VALUES (?)", (relpath,)).lastrowid
+	conn.executemany("INSERT INTO trigrams VALUES (?, ?)", ((trigram, file_id) for trigram in trigrams))
+
+
+def build_index(indexpath: Path, root_dir: Path, indexed_dirs: list[tuple[str, str]]):
+	"""
+	Builds the trigram index from scratch over all files with the given suffix inside the given
+	subdirectories of root_dir. indexed_dirs is a list of (subdirectory, suffix) tuples.
+	"""
+	conn = open_index(indexpath)
+	with conn:
+		conn.execute("DELETE FROM trigrams")
+		conn.execute("DELETE FROM files")
+		for dirname, suffix in indexed_dirs:
+			for filepath in Path(root_dir, dirname).rglob(f"*{suffix}"):
+				index_file(conn, root_dir, filepath.relative_to(root_dir).as_posix())
+	conn.close()
+
+def update_index(indexpath: Path, root_dir: Path, indexed_dirs: list[tuple[str, str]], file_changes: dict[str, str]):
+	"""
+	Updates the trigram index for the files of a file change dict, as it is created by the updater.
+	Files that are not inside of the indexed directories are ignored.
+	"""
+	conn = open_index(indexpath)
+	with conn:
+		for relpath, change in file_changes.items():
+			if not is_indexed_path(relpath, indexed_dirs): continue
+			if change == "D":
+				remove_file(conn, relpath)
+			else:
+				index_file(conn, root_dir, relpath)
+	conn.close()
+
+
+def search(indexpath: Path, root_dir: Path, query: str, ignore_case: bool = True):
+	"""
+	Searches all indexed files for the query string.
+	Returns a list of (relative filepath, line number, line) tuples of all matching lines.
+	"""
+	conn = open_index(indexpath)
+	trigrams = text_trigrams(query)
+	if trigrams:
+		# only files that contain all trigrams of the query can contain the query
+		placeholders = ", ".join("?" * len(trigrams))
+		cursor = conn.execute(f"""
+			SELECT files.path FROM trigrams JOIN files ON files.id=trigrams.file
+			WHERE trigram IN ({placeholders})
+			GROUP BY trigrams.file HAVING COUNT(*)=?
+			ORDER BY files.path
+		""", (*trigrams, len(trigrams)))
+	else:
+		cursor = conn.execute("SELECT path FROM files ORDER BY path")
+	candidates = [relpath for (relpath,) in cursor]
+	conn.close()
+
+	if ignore_case:
+		query = query.lower()
+	hits = []
+	for relpath in candidates:
+		filepath = Path(root_dir, relpath)
+		if not filepath.exists(): continue
+		with open(filepath, 'r', encoding='utf8', errors='replace') as f:
+			for lineno, line in enumerate(f, 1):
+				if query in (line.lower() if ignore_case else line):
+					hits.append((relpath, lineno, line.rstrip("\n")))
+	return hits
@@ -0,0 +1,182 @@
+import time
+import logging
+import sqlite3
+import multiprocessing
+from hashlib import blake2b
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from typing import Optional
+
+from . import profiling
+from .packfile import PackArchive, is_unpacked
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS textures (
+	path TEXT PRIMARY KEY,
+	srchash BLOB NOT NULL,
+	format TEXT NOT NULL,
+	srcsize INTEGER NOT NULL,
+	outsize INTEGER NOT NULL,
+	seconds REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+IMAGE_SUFFIXES = ('.png', '.jpg')
+FORMAT_SUFFIXES = {'png': '.png', 'webp': '.webp'}
+CCZ_HEAD = bytes([0x43, 0x43, 0x5A, 0x21])
+
+
+def is_image_path(relpath: str) -> bool:
+	return PurePosixPath(relpath).suffix in IMAGE_SUFFIXES
+
+def target_path(target_dir: Path, relpath: str, fmt: str) -> Path:
+	# the source suffix is kept, so foo.jpg and foo.png do not end up in the same file
+	return Path(target_dir, relpath + FORMAT_SUFFIXES[fmt])
+
+def open_cache(cachepath: Path) -> sqlite3.Connection:
+	cachepath.parent.mkdir(parents=True, exist_ok=True)
+	conn = sqlite3.connect(str(cachepath))
+	conn.execute("PRAGMA journal_mode=WAL")
+	conn.executescript(CACHE_SCHEMA)
+	return conn
+
+
+# worker process
+worker_state = {}
+
+def init_worker(asset_dir: Path, target_dir: Path, fmt: str, archive_root: Optional[Path]):
+	# every worker reads the packed assets through its own archive
+	worker_state['asset_dir'] = asset_dir
+	worker_state['target_dir'] = target_dir
+	worker_state['format'] = fmt
+	worker_state['archive'] = PackArchive(archive_root) if archive_root else None
+
+def read_source(relpath: str) -> Optional[bytes]:
+	archive = worker_state['archive']
+	if archive and not is_unpacked(relpath):
+		data = archive.read(relpath)
+		return bytes(data) if data is not None else None
+	filepath = Path(worker_state['asset_dir'], relpath)
+	if not filepath.exists(): return None
+	with open(filepath, 'rb') as f:
+		return f.read()
+
+def encode_image(data: bytes, fmt: str) -> bytes:
+	from PIL import Image
+
+	out = BytesIO()
+	with Image.open(BytesIO(data)) as img:
+		if fmt == 'webp':
+			img.save(out, 'WEBP', lossless=True, quality=100, method=4)
+		else:
+			img.save(out, 'PNG', optimize=True)
+	return out.getvalue()
+
+def transcode_image(task: tuple[str, Optional[bytes]]):
+	"""
+	Transcodes a single image unless its hash matches the cached hash.
+	Returns (relpath, status, source hash, source size, output size, seconds, error).
+	"""
+	relpath, cachedhash = task
+	start = time.perf_counter()
+	data = read_source(relpath)
+	# pvr.ccz files keep the suffix of the image they contain
+	if data is None or data[:4] == CCZ_HEAD:
+		return relpath, "skipped", None, 0, 0, 0.0, None
+	srchash = blake2b(data, digest_size=16).digest()
+	targetpath = target_path(worker_state['target_dir'], relpath, worker_state['format'])
+	if srchash == cachedhash and targetpath.exists():
+		return relpath, "cached", srchash, len(data), 0, 0.0, None
+
+	try:
+		encoded = encode_image(data, worker_state['format'])
+	except Exception as e:
+		# a single broken or oversized image must not stop the other images
+		return relpath, "failed", srchash, len(data), 0, 0.0, f"{type(e).__name__}: {e}"
+	targetpath.parent.mkdir(parents=True, exist_ok=True)
+	with open(targetpath, 'wb') as f:
+		f.write(encoded)
+	return relpath, "transcoded", srchash, len(data), len(encoded), time.perf_counter() - start, None
+
+
+# main process
+def transcode_textures(asset_dir: Path, target_dir: Path, cachepath: Path, relpaths: list[str], fmt: str = 'webp',
+						archive: Optional[PackArchive] = None, processes: int = None, chunksize: int = 8) -> dict:
+	"""
+	Transcodes the images at the relative paths of asset_dir into target_dir in parallel.
+	Images whose content did not change since their last transcoding are skipped.
+
+	Returns a report with the amount of images per status, the sizes of the
+	transcoded images before and after and the encoding time saved by the cache.
+	"""
+	report = {"transcoded": 0, "cached": 0, "skipped": 0, "failed": 0, "srcsize": 0, "outsize": 0, "seconds": 0.0, "seconds_saved": 0.0}
+	if not relpaths: return report
+
+	conn = open_cache(cachepath)
+	cached = {path: (srchash, seconds) for path, srchash, seconds in conn.execute("SELECT path, srchash, seconds FROM textures WHERE format=?", (fmt,))}
+	tasks = [(relpath, cached.get(relpath, (None, 0.0))[0]) for relpath in relpaths]
+
+	start = time.perf_counter()
+	initializer, initargs = profiling.pool_initializer("transcode", init_worker, (asset_dir, target_dir, fmt, archive.root if archive else None))
+	with multiprocessing.Pool(processes, initializer, initargs) as pool:
+		for i, result in enumerate(pool.imap_unordered(transcode_image, tasks, chunksize), 1):
+			relpath, status, srchash, srcsize, outsize, seconds, error = result
+			report[status] += 1
+			if status == "failed":
+				logging.warning(f"Failed to transcode {relpath}: {error}")
+			elif status == "cached":
+				report["seconds_saved"] += cached[relpath][1]
+			elif status == "transcoded":
+				report["srcsize"] += srcsize
+				report["outsize"] += outsize
+				conn.execute("REPLACE INTO textures VALUES (?, ?, ?, ?, ?, ?)", (relpath, srchash, fmt, srcsize, outsize, seconds))
+			# commit from time to time, so an interrupted run keeps its progress
+			if i % 256 == 0: conn.commit()
+		# let the workers exit on their own, so profiled workers can write their results
+		pool.close()
+		pool.join()
+	conn.commit()
+	conn.close()
+	report["seconds"] = time.perf_counter() - start
+	return report
+
+def remove_textures(target_dir: Path, cachepath: Path, relpaths: list[str], fmt: str = 'webp'):
+	"""Removes the transcoded images of deleted source images."""
+	conn = open_cache(cachepath)
+	with conn:
+		for relpath in relpaths:
+			target_path(target_dir, relpath, fmt).unlink(missing_ok=True)
+			conn.execute("DELETE FROM textures WHERE path=?", (relpath,))
+	conn.close()
+
+def source_images(asset_dir: Path, archive: Optional[PackArchive] = None) -> list[str]:
+	"""Lists the relative paths of all images inside asset_dir and the archive."""
+	relpaths = [filepath.relative_to(asset_dir).as_posix() for suffix in IMAGE_SUFFIXES for filepath in asset_dir.rglob('*'+suffix)]
+	if archive:
+		relpaths.extend(path for path in archive.paths() if is_image_path(path))
+	return sorted(set(relpaths))
+
+def transcode_all(asset_dir: Path, target_dir: Path, cachepath: Path, fmt: str = 'webp', archive: Optional[PackArchive] = None, excluded_dirs: Optional[list[Path]] = None, processes: int = None) -> dict:
+	"""Transcodes all images of asset_dir and removes the transcoded images whose source does not exist anymore."""
+	excluded = tuple(Path(excluded_dir).relative_to(asset_dir).as_posix() + '/' for excluded_dir in excluded_dirs or [] if Path(excluded_dir).is_relative_to(asset_dir))
+	relpaths = [relpath for relpath in source_images(asset_dir, archive) if not relpath.startswith(excluded)]
+	conn = open_cache(cachepath)
+	cached_paths = [path for (path,) in conn.execute("SELECT path FROM textures")]
+	conn.close()
+	current = set(relpaths)
+	remove_textures(target_dir, cachepath, [path for path in cached_paths if path not in current], fmt)
+	return transcode_textures(asset_dir, target_dir, cachepath, relpaths, fmt, archive, processes)
+
+def transcode_changes(asset_dir: Path, target_dir: Path, cachepath: Path, file_changes: dict[str, str], fmt: str = 'webp', archive: Optional[PackArchive] = None, processes: int = None) -> dict:
+	"""Transcodes the new and changed images of an update and removes the deleted ones."""
+	changed = sorted(relpath for relpath, change in file_changes.items() if change != "D" and is_image_path(relpath))
+	deleted = [relpath for relpath, change in file_changes.items() if change == "D" and is_image_path(relpath)]
+	remove_textures(target_dir, cachepath, deleted, fmt)
+	return transcode_textures(asset_dir, target_dir, cachepath, changed, fmt, archive, processes)
+
+def format_report(report: dict) -> str:
+	saved = report["srcsize"] - report["outsize"]
+	percentage = saved / report["srcsize"] * 100 if report["srcsize"] else 0.0
+	return (f"Transcoded {report['transcoded']} images ({report['cached']} unchanged, {report['skipped']} skipped, {report['failed']} failed) in {report['seconds']:.1f}s. "
+		f"Size: {report['srcsize'] / 1024**2:.1f} MiB -> {report['outsize'] / 1024**2:.1f} MiB, saved {saved / 1024**2:.1f} MiB ({percentage:.1f}%). "
+		f"The cache saved {report['seconds_saved']:.1f}s of encoding.")
@@ -1,5 +1,6 @@
 import os
 import json
+import shutil
 import logging
 from pathlib import Path
 
@@ -17,17 +18,72 @@ class JsonConfig(dict):
 		super().__init__(json_dict)
 
 	def save(self, *json_dump_args):
+		break_link(self.path)
 		with open(self.path, 'w', encoding='utf8') as f:
 			json.dump(self, f, *json_dump_args)
 
 
 # useful file path operations
 def mkdir(dirpath: Path):
-	if not dirpath.exists():
-		dirpath.mkdir(parents=True)
+	# other processes may create the same directory at the same time
+	dirpath.mkdir(parents=True, exist_ok=True)
 def mkdirs(filepath: Path):
 	mkdir(filepath.parent)
 
+FICLONE = 0x40049409 # linux ioctl to create a copy-on-write clone of a file
+def reflink(src: Path, target: Path) -> bool:
+	try:
+		import fcntl
+	except ImportError:
+		return False
+	# an existing target may be a hardlink of src, opening it for writing would truncate src
+	with open(src, 'rb') as srcfile, open(target, 'xb') as targetfile:
+		try:
+			fcntl.ioctl(targetfile.fileno(), FICLONE, srcfile.fileno())
+			return True
+		except OSError:
+			pass
+	target.unlink()
+	return False
+
+def link_or_copy(src: Path, target: Path) -> bool:
+	"""
+	Creates target with the same content as src without duplicating the data on disk.
+	Tries a reflink first, then a hardlink and copies the file if both fail (e.g. across devices).
+
+	An existing target is never overwritten, FileExistsError is raised instead.
+	Returns True if the data is shared with src, False if it had to be copied.
+	"""
+	if reflink(src, target):
+		return True
+	try:
+		os.link(src, target)
+		return True
+	except FileExistsError:
+		raise
+	except OSError:
+		with open(src, 'rb') as srcfile, open(target, 'xb') as targetfile:
+			shutil.copyfileobj(srcfile, targetfile)
+		return False
+
+def break_link(filepath: Path):
+	"""
+	Removes the file if it is a hardlink that shares its data with other paths,
+	so writing a new file to the path does not change the content of the other paths.
+	"""
+	if filepath.exists() and filepath.stat().st_nlink > 1:
+		filepath.unlink()
+
+def unshare(filepath: Path):
+	"""
+	Replaces a hardlinked file by a copy of itself, so it can be changed in place
+	without changing the content of the other paths.
+	"""
+	if filepath.exists() and filepath.stat().st_nlink > 1:
+		temppath = filepath.with_name(filepath.name + ".tmp")
+		shutil.copyfile(filepath, temppath)
+		os.replace(temppath, filepath)
+
 
 # stolen from https://stackoverflow.com/questions/3173320/text-progress-bar-in-the-console
 def printProgressBar(iteration, total, prefix = '', suffix = 'Complete', decimals = 1, length = 50, fill = '█', printEnd = "\r"):
@@ -1,4 +1,6 @@
-from . import xxtea_decrypt
+from . import xxtea_decrypt, xxtea_encrypt
 
 decrypt = xxtea_decrypt.decrypt
-decrypt_file = xxtea_decrypt.decrypt_file
\ No newline at end of file
+decrypt_file = xxtea_decrypt.decrypt_file
+encrypt = xxtea_encrypt.encrypt
+encrypt_file = xxtea_encrypt.encrypt_file
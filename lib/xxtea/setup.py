@@ -2,6 +2,6 @@ from setuptools import setup
 from Cython.Build import cythonize
 
 setup(
-    ext_modules=cythonize(['xxtea_vars.pyx'],
+    ext_modules=cythonize(['xxtea_vars.pyx', 'xxtea_cipher.pyx'],
                           annotate=True),
 )
\ No newline at end of file
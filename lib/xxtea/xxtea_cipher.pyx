@@ -0,0 +1,66 @@
+#cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+from libc.stdint cimport uint32_t
+from libc.stdlib cimport malloc, free
+
+cdef uint32_t DELTA = 0x9E3779B9
+
+cdef inline uint32_t mx(uint32_t total, uint32_t y, uint32_t z, Py_ssize_t p, uint32_t e, uint32_t* k) nogil:
+	return (((z >> 5) ^ (y << 2)) + ((y >> 3) ^ (z << 4))) ^ ((total ^ y) + (k[(p & 3) ^ e] ^ z))
+
+def encrypt(const unsigned char[:] data, const unsigned char[:] key):
+	"""
+	Encrypts the data like xxtea_cocos2d.encrypt, the length of the data is
+	appended as last word. The key has to be 16 bytes long.
+	"""
+	cdef Py_ssize_t datalen = data.shape[0]
+	if datalen == 0:
+		return b''
+	if key.shape[0] != 16:
+		raise ValueError("The key has to be 16 bytes long.")
+
+	# the data is padded with zeros to full little endian words, followed by a word with its length
+	cdef Py_ssize_t n = (datalen + 3) // 4
+	cdef uint32_t* v = <uint32_t*> malloc((n + 1) * sizeof(uint32_t))
+	if v == NULL:
+		raise MemoryError()
+	cdef uint32_t k[4]
+	cdef unsigned char* out
+	cdef Py_ssize_t i, p
+	cdef uint32_t y, z, total, e
+	cdef int q
+	try:
+		for i in range(n):
+			v[i] = 0
+		for i in range(datalen):
+			v[i >> 2] |= (<uint32_t> data[i]) << ((i & 3) * 8)
+		v[n] = <uint32_t> datalen
+		for i in range(4):
+			k[i] = key[i*4] | (<uint32_t> key[i*4+1] << 8) | (<uint32_t> key[i*4+2] << 16) | (<uint32_t> key[i*4+3] << 24)
+
+		with nogil:
+			z = v[n]
+			total = 0
+			q = 6 + 52 // (n + 1)
+			while q > 0:
+				total += DELTA
+				e = (total >> 2) & 3
+				for p in range(n):
+					y = v[p + 1]
+					v[p] += mx(total, y, z, p, e, k)
+					z = v[p]
+				y = v[0]
+				v[n] += mx(total, y, z, n, e, k)
+				z = v[n]
+				q -= 1
+
+		# the words are written back little endian into the memory of the words themselves
+		out = <unsigned char*> v
+		for i in range(n + 1):
+			y = v[i]
+			out[i*4] = y & 0xFF
+			out[i*4+1] = (y >> 8) & 0xFF
+			out[i*4+2] = (y >> 16) & 0xFF
+			out[i*4+3] = (y >> 24) & 0xFF
+		return out[:(n + 1) * 4]
+	finally:
+		free(v)
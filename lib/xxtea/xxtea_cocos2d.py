@@ -22,9 +22,11 @@ def _str2long(s, w):
 	return v
 
 def encrypt(str, key):
-	if str == '': return str
+	if not str: return str
+	if isinstance(key, type(u'')):
+		key = key.encode('ascii')
 	v = _str2long(str, True)
-	k = _str2long(key.ljust(16, "\0"), False)
+	k = _str2long(key.ljust(16, b"\0"), False)
 	n = len(v) - 1
 	z = v[n]
 	y = v[0]
@@ -44,7 +46,7 @@ def encrypt(str, key):
 	return _long2str(v, False)
 
 def decrypt(str, key):
-	if str == b'': return str
+	if not str: return str
 	v = _str2long(str, False)
 	k = _str2long(key, False)
 	n = len(v) - 1
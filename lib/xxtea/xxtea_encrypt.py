@@ -0,0 +1,34 @@
+from . import xxtea_cipher, xxtea_vars
+from .xxtea_decrypt import SIGN_LUA, SIGN_OTHER
+from hashlib import blake2b
+
+
+# execute encryption
+def encrypt(datain: bytes, is_lua: bool, encrypt_len: int = None, keybytes: bytes = None):
+	"""
+	Encrypts data into the format that decrypt reads.
+
+	Lua files are encrypted completely, other files only up to encrypt_len bytes
+	with the rest appended unencrypted. The two key bytes are derived from the data
+	if not given, so encrypting the same data always gives the same result.
+	"""
+	if keybytes is None:
+		keybytes = blake2b(datain, digest_size=2).digest()
+	key = xxtea_vars.generate_key(keybytes[0], keybytes[1]).ljust(16, b'\0')
+	assert len(key) == 16
+
+	if is_lua:
+		return b''.join((SIGN_LUA, keybytes, xxtea_cipher.encrypt(datain, key)))
+
+	if encrypt_len is None:
+		encrypt_len = len(datain)
+	encrypted_bytes = xxtea_cipher.encrypt(datain[:encrypt_len], key)
+	return b''.join((SIGN_OTHER, keybytes, len(encrypted_bytes).to_bytes(4, 'big'), encrypted_bytes, datain[encrypt_len:]))
+
+
+def encrypt_file(srcfile, targetfile, is_lua: bool, encrypt_len: int = None):
+	with open(srcfile, "rb") as srcf:
+		src_bytes = srcf.read()
+	bytes_out = encrypt(src_bytes, is_lua, encrypt_len)
+	with open(targetfile, "wb") as targetf:
+		targetf.write(bytes_out)
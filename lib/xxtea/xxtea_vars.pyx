@@ -20,10 +20,10 @@ def calculate_sign(bint isluafile):
 
 cdef calculate_key():
 	cdef unsigned char i, var
-	cdef unsigned char[48] key
+	cdef unsigned char[49] key
 	cdef unsigned char[49] keybytes
 
-	for i in range(48): key[i] = 0 # init key
+	for i in range(49): key[i] = 0 # init key
 	keybytes = [
 		0xF6, 0x99, 0xE9, 0x90,		0xE2, 0x8B, 0xEC, 0x84,
 		0xF0, 0xD8, 0x9B, 0xB2,		0x9E, 0xAC, 0x9C, 0xAD,
@@ -38,11 +38,11 @@ cdef calculate_key():
 	for i in range(49):
 		key[i] = var ^ keybytes[i]
 		var = keybytes[i]
-	return key
+	return key[:48] # the last byte is the string terminator
 
 
 cdef unsigned char[48] GLOBAL_KEY = calculate_key()
-cdef unsigned char GLOBAL_KEYLEN = len(GLOBAL_KEY)
+cdef unsigned char GLOBAL_KEYLEN = 48
 
 def generate_key(int char1, int char2):
 	cdef int var1
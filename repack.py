@@ -0,0 +1,77 @@
+import argparse
+import itertools
+import json
+import time
+from pathlib import Path
+from typing import Optional
+
+from lib import repack
+
+
+def split_by_size(src_dir: Path, assetpaths: list[str], pack_size: int) -> list[list[str]]:
+	"""Splits the assets into groups whose source files sum up to at most pack_size bytes."""
+	groups = [[]]
+	groupsize = 0
+	for assetpath in assetpaths:
+		filesize = Path(src_dir, assetpath).stat().st_size
+		if groups[-1] and groupsize + filesize > pack_size:
+			groups.append([])
+			groupsize = 0
+		groups[-1].append(assetpath)
+		groupsize += filesize
+	return groups
+
+def main(src_dir: Path, target_dir: Path, version: int, cdn_url: str, patch: bool = False, deleted_assets: Optional[list[str]] = None,
+		pack_size: int = None, encrypt_len: int = None, processes: int = None):
+	assetpaths = sorted(filepath.relative_to(src_dir).as_posix() for filepath in src_dir.rglob('*') if filepath.is_file())
+	print(f"Encrypting {len(assetpaths)} files...")
+	start = time.perf_counter()
+	encrypted_assets = repack.encrypt_assets(src_dir, assetpaths, processes, encrypt_len=encrypt_len)
+
+	if patch:
+		patch_dir = Path(target_dir, "patch", str(version))
+		written = repack.write_patch_files(patch_dir, encrypted_assets)
+		patch_files = [(f"patch/{version}/{assetpath}", assetpath) for assetpath in assetpaths]
+		response = repack.version_check_response(cdn_url, version, patch_files=patch_files)
+	else:
+		update_dir = Path(target_dir, "update")
+		update_dir.mkdir(parents=True, exist_ok=True)
+		groups = split_by_size(src_dir, assetpaths, pack_size) if pack_size else [assetpaths]
+		written = 0
+		pack_urls = []
+		for i, group in enumerate(groups):
+			# the deletions are written into the last pack, so they are applied after all additions
+			pack_deletions = deleted_assets if i == len(groups)-1 else None
+			packname = f"{version}_{i}.zip"
+			written += repack.build_update_pack(Path(update_dir, packname), version, itertools.islice(encrypted_assets, len(group)), pack_deletions)
+			pack_urls.append(f"update/{packname}")
+		response = repack.version_check_response(cdn_url, version, pack_urls)
+
+	with open(Path(target_dir, "version_check.json"), 'w', encoding='utf8') as f:
+		json.dump(response, f, indent=4)
+
+	duration = time.perf_counter() - start
+	print(f"Wrote {written / 1024**2:.1f} MiB in {duration:.1f}s ({written / 1024**2 / duration:.1f} MiB/s).")
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('src', type=str, help="Directory with the decrypted assets to pack.")
+	parser.add_argument('-o', '--output', required=True, type=str, help="Directory to write the packs and the version check response to, usable as cdn root.")
+	parser.add_argument('-v', '--version', required=True, type=int, help="The target version of the update or patch.")
+	parser.add_argument('--cdn-url', type=str, default="http://localhost:8000/", help="The cdn url written into the version check response.")
+	parser.add_argument('--patch', action='store_true', help="Writes single patch files instead of update packs.")
+	parser.add_argument('--delete', type=str, nargs='*', default=[], help="Asset paths the update pack marks as deleted.")
+	parser.add_argument('--pack-size', type=int, help="Splits the update into multiple packs of at most this many MiB.")
+	parser.add_argument('--encrypt-len', type=int, help="Only encrypts the first bytes of non lua files, the rest is stored unencrypted.")
+	parser.add_argument('-p', '--processes', type=int, help="Amount of processes to encrypt with. Defaults to the cpu count.")
+
+def run(args: argparse.Namespace):
+	pack_size = args.pack_size * 1024**2 if args.pack_size else None
+	main(Path(args.src), Path(args.output), args.version, args.cdn_url, args.patch, args.delete, pack_size, args.encrypt_len, args.processes)
+
+
+if __name__ == "__main__":
+	# execute parser to allow easy commandline execution
+	parser = argparse.ArgumentParser(description="Encrypts a directory into update packs or patch files in the format of the game.")
+	add_arguments(parser)
+	run(parser.parse_args())
@@ -0,0 +1,37 @@
+import argparse
+from pathlib import Path
+
+from lib import Client, textindex
+from lib.util import JsonConfig
+
+
+def main(client: Client, query: str, ignore_case: bool = True, rebuild: bool = False):
+	config = JsonConfig('config.json')
+	ASSET_DIR = Path(config['AssetDir'].format(client = client.locale_code))
+	STATE_DIR = Path(config['StateDir'].format(client = client.locale_code))
+	TEXT_INDEX_PATH = Path(STATE_DIR, "text_index.db")
+	TEXT_INDEX_DIRS = [('script', '.lua'), (config['GameConfigJsonDir'], '.json')]
+
+	if rebuild or not TEXT_INDEX_PATH.exists():
+		print("Building text search index...")
+		textindex.build_index(TEXT_INDEX_PATH, ASSET_DIR, TEXT_INDEX_DIRS)
+
+	for relpath, lineno, line in textindex.search(TEXT_INDEX_PATH, ASSET_DIR, query, ignore_case):
+		print(f"{relpath}:{lineno}: {line.strip()}")
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('-c', '--client', required=True, type=str, help="The client to apply the action to.")
+	parser.add_argument('query', type=str, help="The text to search for.")
+	parser.add_argument('--ignore-case', type=bool, default=True, action=argparse.BooleanOptionalAction, help="Sets whether the search ignores the case.")
+	parser.add_argument('--rebuild', action='store_true', help="Rebuilds the search index before searching.")
+
+def run(args: argparse.Namespace):
+	main(Client[args.client], args.query, args.ignore_case, args.rebuild)
+
+
+if __name__ == "__main__":
+	# execute parser to allow easy commandline execution
+	parser = argparse.ArgumentParser(description="Searches the decompiled lua files and gameconfig json files of a client.")
+	add_arguments(parser)
+	run(parser.parse_args())
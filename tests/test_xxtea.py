@@ -0,0 +1,132 @@
+import os
+import json
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from zipfile import ZipFile, BadZipFile
+
+from lib import xxtea
+from lib.xxtea import xxtea_vars, xxtea_decrypt
+
+# the key of the game, the game derives its xxtea keys from these 48 characters
+GAME_KEY = b"Copyright(C),2017,DragonPunchStorm Tech.Co.,Ltd."
+# the decrypted content of these assets starts with one of the signatures of their file type
+SIGNATURES = {
+	".luac": (b"\x1bLJ",), # luajit bytecode
+	".lua": (b"\x1bLJ",),
+	".png": (b"\x89PNG\r\n\x1a\n", b"CCZ!"), # png or pvr.ccz with the suffix of the png
+	".jpg": (b"\xff\xd8\xff",),
+}
+# the pure python decryption is slow, so only this many assets of each archive are checked
+MAX_CHECKED = 300
+
+
+def reference_key(char1: int, char2: int) -> bytes:
+	delta = max((char1 + char2) % 13, 8)
+	key = [GAME_KEY[char1 % len(GAME_KEY)], GAME_KEY[char2 % len(GAME_KEY)]]
+	for _ in range(2, delta):
+		char1, char2 = char2, char1 + char2
+		key.append(GAME_KEY[char2 % len(GAME_KEY)])
+	return bytes(key).ljust(16, b'\0')
+
+
+class KeyDerivationTest(unittest.TestCase):
+	"""
+	Keeps the derivation on the 48 characters of the key. This only guards against
+	regressions, the real asset tests show that the derivation matches the game.
+	"""
+	def test_keys(self):
+		for char1 in range(256):
+			for char2 in range(256):
+				self.assertEqual(xxtea_vars.generate_key(char1, char2).ljust(16, b'\0'), reference_key(char1, char2), (char1, char2))
+
+	def test_roundtrip(self):
+		data = bytes(range(256)) * 4
+		for is_lua in (True, False):
+			self.assertEqual(xxtea.decrypt(xxtea.encrypt(data, is_lua)), data)
+
+
+def asset_suffix(assetpath: str) -> str:
+	return Path(assetpath).suffix.lower()
+
+def is_encrypted(data: bytes) -> bool:
+	return data.startswith(xxtea_decrypt.SIGN_LUA) or data.startswith(xxtea_decrypt.SIGN_OTHER)
+
+
+class RealAssetTest(unittest.TestCase):
+	"""
+	Decrypts assets exactly as the game ships them and checks that every decrypted
+	asset starts with the signature of its file type. A wrong key derivation fails
+	the length check of the xxtea decryption or yields random data.
+
+	The game can not be shipped with this repository, so these tests only run with
+	XXTEA_XAPK set to the path of an XAPK of a client and/or XXTEA_UPDATE_PACKS set
+	to a directory with update packs of the cdn, e.g. the DownloadCacheDir or the
+	UpdateTempDir of an interrupted update.
+	"""
+	def check_members(self, archive: ZipFile, members: dict[str, str]):
+		"""Decrypts the members of the archive, which are mapped to the assetpaths they are stored as."""
+		checked = 0
+		for member, assetpath in members.items():
+			signatures = SIGNATURES.get(asset_suffix(assetpath))
+			if signatures is None: continue
+			data = archive.read(member)
+			if not is_encrypted(data): continue
+			with self.subTest(member=member, assetpath=assetpath):
+				try:
+					decrypted = xxtea.decrypt(data)
+				except (TypeError, AssertionError) as e:
+					self.fail(f"decryption failed: {e!r}")
+				self.assertTrue(decrypted.startswith(signatures), decrypted[:16])
+			checked += 1
+			if checked == MAX_CHECKED: break
+		return checked
+
+	@unittest.skipUnless(os.environ.get("XXTEA_XAPK"), "XXTEA_XAPK is not set")
+	def test_xapk(self):
+		checked = 0
+		with ZipFile(os.environ["XXTEA_XAPK"], 'r') as xapk_archive:
+			manifest = json.loads(xapk_archive.read('manifest.json').decode('utf8'))
+			with xapk_archive.open(manifest['split_apks'][0]['file'], 'r') as apk_archivefile, ZipFile(apk_archivefile, 'r') as apk_archive:
+				# the asset database maps the hashed member names to the asset paths
+				with tempfile.TemporaryDirectory() as tempdir:
+					dbpath = Path(tempdir, "assets.db")
+					dbpath.write_bytes(apk_archive.read('assets/64/assets.db'))
+					conn = sqlite3.connect(str(dbpath))
+					assetpaths = {dbpath: assetpath for assetpath, _, dbpath, *_ in conn.execute("SELECT * FROM assets")}
+					conn.close()
+
+				apk_members = {file.filename: assetpaths[file.filename.removeprefix('assets/')] for file in apk_archive.filelist if file.filename.removeprefix('assets/') in assetpaths}
+				checked += self.check_members(apk_archive, apk_members)
+
+			for obb_expansion in manifest['expansions']:
+				with xapk_archive.open(obb_expansion['file'], 'r') as obbfile, ZipFile(obbfile, 'r') as obb_archive:
+					obb_members = {file.filename: assetpaths[file.filename] for file in obb_archive.filelist if file.filename in assetpaths}
+					checked += self.check_members(obb_archive, obb_members)
+		self.assertGreater(checked, 0, "no encrypted assets of a known file type found")
+
+	@unittest.skipUnless(os.environ.get("XXTEA_UPDATE_PACKS"), "XXTEA_UPDATE_PACKS is not set")
+	def test_update_packs(self):
+		checked = 0
+		for packpath in Path(os.environ["XXTEA_UPDATE_PACKS"]).rglob('*'):
+			if not packpath.is_file(): continue
+			try:
+				update_archive = ZipFile(packpath, 'r')
+			except (OSError, BadZipFile):
+				continue # not an update pack
+			with update_archive:
+				if 'update' not in update_archive.NameToInfo: continue
+				# the update info lists the assetpath and member name of every asset, after the version and the amount
+				info_lines = update_archive.read('update').decode('utf8').splitlines()[2:]
+				members = {}
+				for line in info_lines:
+					assetpath, member, _, _ = json.loads(line)
+					if member in update_archive.NameToInfo:
+						members[member] = assetpath
+				checked += self.check_members(update_archive, members)
+		self.assertGreater(checked, 0, "no encrypted assets of a known file type found")
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,44 @@
+import argparse
+from pathlib import Path
+
+from lib import Client, texture
+from lib.packfile import PackArchive
+from lib.util import JsonConfig
+
+
+def main(client: Client, fmt: str = None, rebuild: bool = False, processes: int = None):
+	config = JsonConfig('config.json')
+	ASSET_DIR = Path(config['AssetDir'].format(client = client.locale_code))
+	STATE_DIR = Path(config['StateDir'].format(client = client.locale_code))
+	TEXTURE_CACHE_PATH = Path(STATE_DIR, "texture_cache.db")
+	if not config.get('TextureDir'):
+		print("There is no TextureDir set in the config.")
+		exit(1)
+	TEXTURE_DIR = Path(config['TextureDir'].format(client = client.locale_code))
+	PACK_DIR = Path(STATE_DIR, config['PackDir'])
+	fmt = fmt or config.get('TextureFormat', 'webp')
+
+	if rebuild:
+		TEXTURE_CACHE_PATH.unlink(missing_ok=True)
+	archive = PackArchive(PACK_DIR) if config.get('AssetLayout') == 'packed' and PACK_DIR.exists() else None
+	print("Transcoding textures...")
+	report = texture.transcode_all(ASSET_DIR, TEXTURE_DIR, TEXTURE_CACHE_PATH, fmt, archive, [TEXTURE_DIR, Path(ASSET_DIR, config['UnpackTempDir'])], processes)
+	print(texture.format_report(report))
+	if archive: archive.close()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('-c', '--client', required=True, type=str, help="The client to apply the action to.")
+	parser.add_argument('-f', '--format', choices=list(texture.FORMAT_SUFFIXES), help="The format to transcode to. Defaults to the TextureFormat of the config.")
+	parser.add_argument('--rebuild', action='store_true', help="Transcodes all images again, even if they did not change.")
+	parser.add_argument('-p', '--processes', type=int, help="Amount of processes to transcode with. Defaults to the cpu count.")
+
+def run(args: argparse.Namespace):
+	main(Client[args.client], args.format, args.rebuild, args.processes)
+
+
+if __name__ == "__main__":
+	# execute parser to allow easy commandline execution
+	parser = argparse.ArgumentParser(description="Transcodes all png and jpg assets of a client into smaller lossless images.")
+	add_arguments(parser)
+	run(parser.parse_args())
@@ -1,38 +1,65 @@
 import argparse
 import json
 import logging
+import multiprocessing as mp
+import heapq
+import random
+import time
 from pathlib import Path
+from typing import Optional, TYPE_CHECKING
 from zipfile import ZipFile
 
-import requests
-from git import Repo
+from lib import Client, xxtea, gameconfig, gcindex, textindex, decompile, texture, profiling, dlcache
+from lib.util import log_error_exit, get_or_exit, mkdirs, break_link, unshare, JsonConfig
+from lib.store import ContentStore
+from lib.journal import Journal
+from lib.packfile import PackArchive, is_unpacked
 
-from lib import Client, xxtea, gameconfig, decompile
-from lib.util import log_error_exit, get_or_exit, mkdirs, JsonConfig
+# requests and git are only imported once they are needed, to keep the start up fast
+if TYPE_CHECKING:
+	from git import Repo
 
 
 class CdnDownloader():
-	def __init__(self, cndurl, cndurl_fallback):
+	def __init__(self, cndurl, cndurl_fallback, session = None, cache: Optional[dlcache.DownloadCache] = None):
+		if session is None:
+			import requests
+			session = requests
 		self.cdn = cndurl.rstrip("/")
 		self.fallback = cndurl_fallback.rstrip("/")
+		self.session = session
+		self.cache = cache
 
-	@staticmethod
-	def _download(cdn, fileurl):
+	def _download(self, cdn, fileurl):
 		full_url = cdn.rstrip("/") + "/" + fileurl.lstrip("/")
-		result = requests.get(full_url)
+		result = self.session.get(full_url)
 		return result
 
-	def download(self, fileurl: str):
+	def download(self, fileurl: str, size: Optional[int] = None, md5hash: Optional[str] = None):
+		"""Downloads the file, the size and md5 are checked if the server announced them for it."""
+		if self.cache:
+			content = self.cache.get(fileurl, size, md5hash)
+			if content is not None:
+				logging.debug(f"Using cached {fileurl}.")
+				return content
 		result = self._download(self.cdn, fileurl)
+		if not dlcache.matches(result.content, size, md5hash):
+			logging.warning(f"Downloaded {fileurl} does not match the size or md5 of the server.")
+		# error pages and broken downloads must not end up in the cache
+		elif self.cache and result.ok:
+			self.cache.put(fileurl, result.content)
 		return result.content
 
 
-def version_check(vms_url: str, current_version: int, useragent: str, device_id: str):
+def version_check(vms_url: str, current_version: int, useragent: str, device_id: str, session = None):
+	if session is None:
+		import requests
+		session = requests
 	logging.debug("Sending version check...")
 	logging.debug(f"Target URL: {vms_url}.")
 	logging.debug(f"Useragent: {useragent}.")
 	logging.debug(f"DeviceID: {device_id}.")
-	response = requests.post(
+	response = session.post(
 		url = vms_url,
 		headers = {
 			"Accept-Encoding": "identity",
@@ -52,78 +79,224 @@ def version_check(vms_url: str, current_version: int, useragent: str, device_id:
 	logging.debug("Finished sending version check.")
 	return response.json()
 
-def extrack_update_pack(update_packs: list[Path], target_parentdir: Path):
-	update_files_changes = {}
-	for update_archive_path in update_packs:
-		with ZipFile(update_archive_path, 'r') as update_archive:
-			# open update info file and read content
-			with update_archive.open('update', 'r') as update_info:
-				update_data = update_info.read().decode('utf8')
-
-			# split update info by lines and read version number from first line
-			update_data_lines = update_data.splitlines(False)
-			version_target = update_data_lines[0].replace("version:", "")
-
-			# iterate over info lines starting at the second (where the info starts)
-			for assetdata in update_data_lines[2:]:
-				assetpath, dbpath, _, _ = json.loads(assetdata)
+def read_update_info(update_archive_path: Path):
+	"""
+	Reads the update info file of an update pack.
+
+	Returns the target version of the pack and a list of (assetpath, dbpath) tuples.
+	An empty dbpath marks the asset as deleted. Entries whose data is not
+	contained in the pack are left out.
+	"""
+	with ZipFile(update_archive_path, 'r') as update_archive:
+		# open update info file and read content
+		with update_archive.open('update', 'r') as update_info:
+			update_data = update_info.read().decode('utf8')
+
+		# split update info by lines and read version number from first line
+		update_data_lines = update_data.splitlines(False)
+		version_target = int(update_data_lines[0].replace("version:", ""))
+
+		# iterate over info lines starting at the second (where the info starts)
+		entries = []
+		for assetdata in update_data_lines[2:]:
+			assetpath, dbpath, _, _ = json.loads(assetdata)
+			if dbpath != "" and dbpath not in update_archive.NameToInfo: continue
+			entries.append((assetpath, dbpath))
+	return version_target, entries
+
+def resolve_update_packs(update_packs: list[Path]):
+	"""
+	Merges the update info of all update packs into one plan.
+
+	The packs are applied in order of their target version, so for every asset
+	only the last action survives.  
+	Returns the highest target version and a dict mapping each assetpath to a
+	tuple of (update pack path, dbpath), where the pack path is None if the
+	asset gets deleted.
+	"""
+	pack_infos = sorted((read_update_info(pack) + (pack,) for pack in update_packs), key=lambda info: info[0])
+	plan = {}
+	for _, entries, update_archive_path in pack_infos:
+		for assetpath, dbpath in entries:
+			if dbpath == "":
+				plan[assetpath] = (None, dbpath)
+			else:
+				plan[assetpath] = (update_archive_path, dbpath)
+	return pack_infos[-1][0], plan
+
+def extract_update_members(update_archive_path: Path, members: list[tuple[str, Optional[Path]]], store_root: Path = None):
+	"""
+	Decrypts the members of the update pack into their target paths.
+	The decrypted data of members without a target path is returned in a list instead.
+	"""
+	store = ContentStore(store_root) if store_root else None
+	decrypted_members = []
+	with ZipFile(update_archive_path, 'r') as update_archive:
+		for dbpath, assettargetpath in members:
+			with update_archive.open(dbpath, 'r') as assetfile:
+				if assettargetpath is None:
+					decrypted_members.append(xxtea.decrypt(assetfile.read()))
+					continue
+				if store:
+					# only decrypt the data if it is not already in the content store
+					store.materialize(assetfile.read(), assettargetpath, xxtea.decrypt)
+					continue
+				# decrypt and save data to target file
+				decryted_bytes = xxtea.decrypt(assetfile.read())
+			break_link(assettargetpath)
+			with open(assettargetpath, 'wb') as targetfile:
+				targetfile.write(decryted_bytes)
+	return decrypted_members
+
+def extract_update_chunk(indexed_chunk):
+	index, chunk = indexed_chunk
+	return index, extract_update_members(*chunk)
+
+def extrack_update_pack(update_packs: list[Path], target_parentdir: Path, processes: int = None, chunksize: int = 64,
+		store_root: Path = None, journal: Journal = None, stage: str = "extract", archive: PackArchive = None):
+	"""
+	Extracts the update packs into target_parentdir and deletes the packs afterwards.
+	If a journal is given, the progress is recorded in the stage and an interrupted
+	extraction with the same stage is resumed. If an archive is given, all assets
+	that are not processed further are written into the archive instead.
+
+	Returns the target version and a dict of all changed assetpaths.
+	"""
+	version_target, plan = resolve_update_packs(update_packs)
+	resumed = journal is not None and journal.is_started(stage)
+	if resumed:
+		# the changes were determined before the interrupted extraction changed the files
+		update_files_changes = journal.stage_data(stage)['changes']
+		extracted = journal.done_members(stage)
+	else:
+		update_files_changes = {}
+		extracted = {}
+
+	def is_archived(assetpath):
+		return archive is not None and not is_unpacked(assetpath)
+	def asset_exists(assetpath):
+		if is_archived(assetpath):
+			return archive.exists(assetpath)
+		return Path(target_parentdir, assetpath).exists()
+
+	# mark how the files change and collect the members that need to be extracted
+	extraction_tasks = {}
+	for assetpath, (update_archive_path, dbpath) in plan.items():
+		if update_archive_path is None:
+			if asset_exists(assetpath) and not resumed:
+				update_files_changes[assetpath] = "D"
+		elif assetpath not in extracted:
+			if not resumed:
+				update_files_changes[assetpath] = "C" if asset_exists(assetpath) else "N"
+			assettargetpath = None
+			if not is_archived(assetpath):
 				assettargetpath = Path(target_parentdir, assetpath)
-				if dbpath == "":
-					# delete the file if it is marked so
-					if assettargetpath.exists():
-						update_files_changes[assetpath] = "D"
-						assettargetpath.unlink()
-				else:
-					if dbpath not in update_archive.NameToInfo: continue
-					with update_archive.open(dbpath, 'r') as assetfile:
-						# mark how the file changed
-						if assettargetpath.exists():
-							update_files_changes[assetpath] = "C"
-						else:
-							mkdirs(assettargetpath)
-							update_files_changes[assetpath] = "N"
-
-						# decrypt and save data to target file
-						decryted_bytes = xxtea.decrypt(assetfile.read())
-						with open(assettargetpath, 'wb') as targetfile:
-							targetfile.write(decryted_bytes)
-
+				mkdirs(assettargetpath)
+			extraction_tasks.setdefault(update_archive_path, []).append((assetpath, dbpath, assettargetpath))
+	if journal and not resumed:
+		journal.begin(stage, {'version': version_target, 'changes': update_files_changes})
+
+	# delete the files that are marked so
+	for assetpath, (update_archive_path, _) in plan.items():
+		if update_archive_path is None and asset_exists(assetpath):
+			if is_archived(assetpath):
+				archive.delete(assetpath)
+			else:
+				Path(target_parentdir, assetpath).unlink()
+
+	# split the members of each pack into chunks and extract them in parallel
+	chunks = []
+	chunk_assetpaths = []
+	for update_archive_path, members in extraction_tasks.items():
+		for i in range(0, len(members), chunksize):
+			chunk_members = members[i:i+chunksize]
+			chunks.append((update_archive_path, [(dbpath, targetpath) for _, dbpath, targetpath in chunk_members], store_root))
+			chunk_assetpaths.append([(assetpath, targetpath is None) for assetpath, _, targetpath in chunk_members])
+
+	if processes is None:
+		processes = max(mp.cpu_count()-1, 1)
+	if processes > 1 and len(chunks) > 1:
+		initializer, initargs = profiling.pool_initializer("extract")
+		pool = mp.Pool(min(processes, len(chunks)), initializer, initargs)
+		finished_chunks = pool.imap_unordered(extract_update_chunk, enumerate(chunks))
+	else:
+		pool = None
+		finished_chunks = map(extract_update_chunk, enumerate(chunks))
+	try:
+		for index, decrypted_members in finished_chunks:
+			decrypted_members = iter(decrypted_members)
+			for assetpath, archived in chunk_assetpaths[index]:
+				if archived:
+					archive.write(assetpath, next(decrypted_members))
+				if journal:
+					journal.mark(stage, assetpath)
+		if pool:
+			pool.close()
+			pool.join()
+	finally:
+		# stops the workers if the extraction failed, the journal keeps the extracted members
+		if pool:
+			pool.terminate()
+
+	if archive: archive.commit()
+	if journal: journal.finish(stage)
+	for update_archive_path in update_packs:
 		update_archive_path.unlink()
 
-	return int(version_target), update_files_changes
+	return version_target, update_files_changes
+
+
+def client_versions(cocos_config: JsonConfig) -> tuple[int, int]:
+	if "updJobId" in cocos_config:
+		game_version = cocos_config['updJobId']
+	else:
+		game_version = cocos_config['packJobId']
+	if "patchJobId" in cocos_config:
+		patch_version = cocos_config['patchJobId']
+	else:
+		patch_version = game_version
+	return game_version, patch_version
+
 
+def main(client: Client, config: JsonConfig = None, cocos_config: JsonConfig = None, update_repository: 'Repo' = None, response: dict = None, session = None):
+	"""
+	Checks for a new version of the client and applies all available updates and patches.
 
-def main(client: Client):
+	The loaded configs, the repository and the http session can be passed in to reuse them,
+	as well as an already received version check response.
+	"""
 	logging.info(f"Starting version check for {client.name}.")
 
 	# load config file and variables
-	logging.debug("Loading updater config.")
-	config = JsonConfig('config.json')
+	if config is None:
+		logging.debug("Loading updater config.")
+		config = JsonConfig('config.json')
 	ASSET_DIR = Path(config['AssetDir'].format(client = client.locale_code))
 	LUA_DIR = Path(ASSET_DIR, 'script')
 	UPDATE_TEMP_DIR = Path(ASSET_DIR, config['UpdateTempDir'])
 	UPDATE_TEMP_DIR.mkdir(exist_ok=True, parents=True)
 	GAMECONFIG_DIR = Path(ASSET_DIR, config['GameConfigJsonDir'])
 	GAME_CONFIG_PATH = Path(ASSET_DIR, "cocos_app.conf")
-
+	STORE_ROOT = Path(config['ContentStore']) if config.get('ContentStore') else None
+	STATE_DIR = Path(config['StateDir'].format(client = client.locale_code))
+	GAMECONFIG_INDEX_PATH = Path(STATE_DIR, "gameconfig_index.db")
+	TEXT_INDEX_PATH = Path(STATE_DIR, "text_index.db")
+	TEXT_INDEX_DIRS = [('script', '.lua'), (config['GameConfigJsonDir'], '.json')]
+	TEXTURE_DIR = Path(config['TextureDir'].format(client = client.locale_code)) if config.get('TextureDir') else None
+	TEXTURE_CACHE_PATH = Path(STATE_DIR, "texture_cache.db")
 	# load app config
-	logging.debug("Loading app config.")
-	cocos_config = JsonConfig(GAME_CONFIG_PATH)
+	if cocos_config is None:
+		logging.debug("Loading app config.")
+		cocos_config = JsonConfig(GAME_CONFIG_PATH)
 	VMS_URL = cocos_config['captainUrl']
-	if "updJobId" in cocos_config:
-		GAME_VERSION = cocos_config['updJobId']
-	else:
-		GAME_VERSION = cocos_config['packJobId']
-	if "patchJobId" in cocos_config:
-		PATCH_VERSION = cocos_config['patchJobId']
-	else:
-		PATCH_VERSION = GAME_VERSION
+	GAME_VERSION, PATCH_VERSION = client_versions(cocos_config)
 	logging.info(f"Client Version - Game: {GAME_VERSION}, Patch: {PATCH_VERSION}.")
 
 	# send version check to server
 	DEVICE_ID = config['DeviceID']
 	USERAGENT = config['UserAgent']
-	response = version_check(VMS_URL, GAME_VERSION, USERAGENT, DEVICE_ID)
+	if response is None:
+		response = version_check(VMS_URL, GAME_VERSION, USERAGENT, DEVICE_ID, session)
 	if response['status'] == 10001:
 		log_error_exit(f"Wrong Version Information: Version {GAME_VERSION} does not exist.")
 	elif response['status'] != 0:
@@ -140,13 +313,15 @@ def main(client: Client):
 		log_error_exit("Did not receive any CdnUrl.")
 	logging.info(f"Server Version - Game: {latest_version}.")
 
-	# setup downloader and repository
-	downloader = CdnDownloader(cdn_url, cdn_url2)
-	update_repository = Repo(str(Path(config["AssetRepo"])))
+	# setup repository
+	if update_repository is None:
+		from git import Repo
+		update_repository = Repo(str(Path(config["AssetRepo"])))
 
 	# define updater function
 	def apply_update(game_ver_target, patch_ver_target, file_changes):
 		actual_version = max(game_ver_target, patch_ver_target)
+		step_prefix = f"apply:{actual_version}:"
 
 		# save updated file changes
 		filechange_fp = Path(ASSET_DIR, "_update", str(actual_version)+".json")
@@ -156,40 +331,127 @@ def main(client: Client):
 
 		# decrypt, apply and convert gameconfig database
 		db_upd_path = Path(ASSET_DIR, "gameUpdateConfig.db")
-		if db_upd_path.exists():
+		gc_changelog_fp = Path(ASSET_DIR, "_update", f"{actual_version}_gameconfig.json")
+		gc_stage = step_prefix + "gameconfig"
+		# a started stage means the merge may have already happened and deleted the update database
+		if not JOURNAL.is_done(gc_stage) and (db_upd_path.exists() or JOURNAL.is_started(gc_stage)):
 			db_path = Path(ASSET_DIR, "gameConfig.db")
-			gameconfig.decrypt_db(db_upd_path)
-			gameconfig.merge_db(db_path, db_upd_path)
-			gameconfig.convert_db(db_path, GAMECONFIG_DIR)
+			if not JOURNAL.is_started(gc_stage):
+				previous_version = gcindex.latest_version(GAMECONFIG_INDEX_PATH)
+				if previous_version is None:
+					# index the database before the merge, so there is a version to compare against.
+					# the saved version is the one of the last applied update, which may be newer than the one this run started with
+					previous_version = max(client_versions(cocos_config))
+					gcindex.index_db(db_path, GAMECONFIG_INDEX_PATH, previous_version)
+				JOURNAL.begin(gc_stage, previous_version)
+			previous_version = JOURNAL.stage_data(gc_stage)
+
+			with profiling.stage("gameconfig"):
+				if db_upd_path.exists():
+					unshare(db_upd_path) # the database is changed in place
+					gameconfig.decrypt_db(db_upd_path)
+					gameconfig.merge_db(db_path, db_upd_path)
+				gameconfig.convert_db(db_path, GAMECONFIG_DIR)
+
+				# index the merged database and save the row changes since the last indexed version
+				gcindex.index_db(db_path, GAMECONFIG_INDEX_PATH, actual_version)
+				gc_changelog = gcindex.changelog(GAMECONFIG_INDEX_PATH, previous_version, actual_version)
+			with open(gc_changelog_fp, 'w', encoding='utf8') as f:
+				json.dump(gc_changelog, f, indent=4, ensure_ascii=False)
+			JOURNAL.finish(gc_stage)
+			# the versions are only removed once the changelog is written, as a resumed run compares against the previous one
+			removed_versions = gcindex.prune(GAMECONFIG_INDEX_PATH, config.get('GameConfigIndexVersions', 0))
+			if removed_versions:
+				logging.debug(f"Removed the gameconfig index of versions {', '.join(map(str, removed_versions))}.")
+
+		gc_changelog = {}
+		if JOURNAL.is_done(gc_stage):
+			with open(gc_changelog_fp, 'r', encoding='utf8') as f:
+				gc_changelog = json.load(f)
 
 		# decompile lua files
-		decompile.recursive_decompile_dir(LUA_DIR)
-
-		# save version number
-		cocos_config['updJobId'] = int(game_ver_target)
-		cocos_config['patchJobId'] = int(patch_ver_target)
-		cocos_config.save()
-
-		# commit to the repository
-		update_repository.git.add(client.locale_code) # adds only all files inside the current clients directory
-		update_repository.git.commit('-m', f'[{client.locale_code}] GAME: {actual_version}')
-		update_repository.remotes.origin.push()
+		with profiling.stage("decompile"):
+			decompile.recursive_decompile_dir(LUA_DIR)
+
+		# update the text search index with the decompiled lua files and changed gameconfig tables
+		with profiling.stage("index"):
+			if TEXT_INDEX_PATH.exists():
+				text_changes = {}
+				for assetpath, change in file_changes.items():
+					if assetpath.endswith('.luac'):
+						assetpath = assetpath.removesuffix('.luac') + '.lua'
+					text_changes[assetpath] = change
+				for tablename in gc_changelog:
+					text_changes[f"{config['GameConfigJsonDir']}/{tablename}.json"] = "C"
+				textindex.update_index(TEXT_INDEX_PATH, ASSET_DIR, TEXT_INDEX_DIRS, text_changes)
+			else:
+				textindex.build_index(TEXT_INDEX_PATH, ASSET_DIR, TEXT_INDEX_DIRS)
+
+		# transcode the new and changed images, the cache skips images already transcoded by an interrupted run
+		if TEXTURE_DIR:
+			if ARCHIVE: ARCHIVE.commit()
+			with profiling.stage("textures"):
+				report = texture.transcode_changes(ASSET_DIR, TEXTURE_DIR, TEXTURE_CACHE_PATH, file_changes, config.get('TextureFormat', 'webp'), ARCHIVE)
+			logging.info(texture.format_report(report))
+
+		# save version number, the started commit stage lets the next run finish the commit if this one gets interrupted
+		commit_stage = step_prefix + "commit"
+		if not JOURNAL.is_done(commit_stage):
+			JOURNAL.begin(commit_stage, actual_version)
+			cocos_config['updJobId'] = int(game_ver_target)
+			cocos_config['patchJobId'] = int(patch_ver_target)
+			cocos_config.save()
+		commit_update(actual_version)
+
+	def commit_update(actual_version):
+		step_prefix = f"apply:{actual_version}:"
+		with profiling.stage("commit"):
+			if not JOURNAL.is_done(step_prefix + "commit"):
+				update_repository.git.add(client.locale_code) # adds only all files inside the current clients directory
+				# an interrupted run may have committed already
+				if update_repository.is_dirty(index=True, working_tree=False, path=client.locale_code):
+					update_repository.git.commit('-m', f'[{client.locale_code}] GAME: {actual_version}')
+				JOURNAL.finish(step_prefix + "commit")
+			update_repository.remotes.origin.push()
+		JOURNAL.clear(f"apply:{actual_version}")
 
 	def execute_update():
 		# pylint: disable=used-before-assignment
 		if int(latest_version) <= GAME_VERSION:
 			logging.info("Client is on newest version.")
 		else:
-			for pack_upd in data['pack'].values():
-				update_zips = []
-				for file in pack_upd['64']:
-					content = downloader.download(file['url'])
-					targetfile = Path(UPDATE_TEMP_DIR, Path(file['url']).name)
-					with open(targetfile, 'wb') as f:
-						f.write(content)
-					update_zips.append(targetfile)
-				updated_version, file_changes = extrack_update_pack(update_zips, ASSET_DIR)
+			for pack_key, pack_upd in data['pack'].items():
+				download_stage = f"download:{pack_key}"
+				extract_stage = f"extract:{pack_key}"
+				# the stages only belong to this update if it consists of the same packs
+				pack_urls = [file['url'] for file in pack_upd['64']]
+				if JOURNAL.is_started(download_stage) and JOURNAL.stage_data(download_stage) != pack_urls:
+					logging.warning(f"The packs of {pack_key} changed since the interrupted update, it is started again.")
+					JOURNAL.clear(download_stage)
+					JOURNAL.clear(extract_stage)
+				JOURNAL.begin(download_stage, pack_urls)
+				if JOURNAL.is_done(extract_stage):
+					# the packs were already extracted and deleted by an interrupted run
+					extract_data = JOURNAL.stage_data(extract_stage)
+					updated_version, file_changes = extract_data['version'], extract_data['changes']
+				else:
+					downloaded = JOURNAL.done_members(download_stage)
+					update_zips = []
+					with profiling.stage(download_stage):
+						for file in pack_upd['64']:
+							targetfile = Path(UPDATE_TEMP_DIR, Path(file['url']).name)
+							if file['url'] not in downloaded or not targetfile.exists():
+								content = downloader.download(file['url'], file.get('size'), file.get('md5'))
+								with open(targetfile, 'wb') as f:
+									f.write(content)
+								JOURNAL.mark(download_stage, file['url'])
+							update_zips.append(targetfile)
+					JOURNAL.finish(download_stage)
+					with profiling.stage(extract_stage):
+						updated_version, file_changes = extrack_update_pack(update_zips, ASSET_DIR, store_root=STORE_ROOT, journal=JOURNAL, stage=extract_stage, archive=ARCHIVE)
 				apply_update(updated_version, updated_version, file_changes)
+				JOURNAL.clear(download_stage)
+				JOURNAL.clear(extract_stage)
 
 	def execute_patch():
 		patch_version = int(data['patchInfo']['patchVersion'])
@@ -199,28 +461,65 @@ def main(client: Client):
 		else:
 			patch = data['patchInfo']['patch']['64']
 			logging.info(f"New Patch Available with {len(patch)} files.")
-			changed_files = {}
+			patch_stage = f"patch:{patch_version}"
+			changed_files = JOURNAL.done_members(patch_stage)
 			for patchedfile in patch:
-				content = downloader.download(patchedfile['url'])
 				logictargetpath = patchedfile['logic']
+				if logictargetpath in changed_files: continue
+				content = downloader.download(patchedfile['url'], patchedfile.get('size'), patchedfile.get('md5'))
+				if ARCHIVE and not is_unpacked(logictargetpath):
+					changed_files[logictargetpath] = "C" if ARCHIVE.exists(logictargetpath) else "N"
+					ARCHIVE.write(logictargetpath, xxtea.decrypt(content))
+					JOURNAL.mark(patch_stage, logictargetpath, changed_files[logictargetpath])
+					continue
 				targetpath = Path(ASSET_DIR, logictargetpath)
 				if targetpath.exists(): changed_files[logictargetpath] = "C"
 				else:
 					changed_files[logictargetpath] = "N"
 					mkdirs(targetpath)
-				with open(targetpath, 'wb') as f:
-					decrypted_data = xxtea.decrypt(content)
-					f.write(decrypted_data)
+				if STORE_ROOT:
+					ContentStore(STORE_ROOT).materialize(content, targetpath, xxtea.decrypt)
+				else:
+					break_link(targetpath)
+					with open(targetpath, 'wb') as f:
+						decrypted_data = xxtea.decrypt(content)
+						f.write(decrypted_data)
+				JOURNAL.mark(patch_stage, logictargetpath, changed_files[logictargetpath])
+			JOURNAL.finish(patch_stage)
 			apply_update(GAME_VERSION, patch_version, changed_files)
-
-	if retval == 0:
-		logging.debug("Starting patch routine.")
-		execute_patch()
-	elif retval == 1:
-		logging.debug("Starting update and patch routines.")
-		execute_update()
-		#execute_patch()
-		main(client)
+			JOURNAL.clear(patch_stage)
+
+	if retval in (0, 1):
+		# the journal, archive and download cache are only opened for the update routines and closed before the next version check
+		JOURNAL = Journal(Path(STATE_DIR, "update_journal.db"))
+		DOWNLOAD_CACHE = dlcache.DownloadCache(config['DownloadCacheDir'], config.get('DownloadCacheSize', 4096) * 1024**2) if config.get('DownloadCacheDir') else None
+		downloader = CdnDownloader(cdn_url, cdn_url2, session, DOWNLOAD_CACHE)
+		ARCHIVE = None
+		if config.get('AssetLayout') == 'packed':
+			ARCHIVE = PackArchive(Path(STATE_DIR, config['PackDir']))
+			JOURNAL.before_flush.append(ARCHIVE.commit)
+		try:
+			# the version of an interrupted run is already saved, so only its commit is left to do
+			for stage, actual_version in JOURNAL.unfinished("apply").items():
+				if stage.endswith(":commit"):
+					logging.info(f"Finishing the commit of version {actual_version}.")
+					commit_update(actual_version)
+			if retval == 0:
+				logging.debug("Starting patch routine.")
+				with profiling.stage("patch"):
+					execute_patch()
+			else:
+				logging.debug("Starting update and patch routines.")
+				with profiling.stage("update"):
+					execute_update()
+				#execute_patch()
+		finally:
+			# the last flush of the journal commits the archive, so the journal has to be closed first
+			JOURNAL.close()
+			if ARCHIVE: ARCHIVE.close()
+			if DOWNLOAD_CACHE: DOWNLOAD_CACHE.close()
+		if retval == 1:
+			main(client, config, cocos_config, update_repository, session=session)
 	elif retval == 2:
 		logging.warning("The server is currently in maintanance mode.")
 		notice = get_or_exit(data, 'notice', "Invalid response: No notice.")
@@ -232,7 +531,70 @@ def main(client: Client):
 		logging.warning("There is no update / Unknown return code.")
 
 
-if __name__ == "__main__":
+def poll_client(client: Client, config: JsonConfig, cocos_config: JsonConfig, update_repository: 'Repo', session) -> bool:
+	"""
+	Sends a version check for the client and starts the updater only if the game or patch version moved.
+	Returns False if the check failed or the server is in maintenance mode, so the caller can back off.
+	"""
+	game_version, patch_version = client_versions(cocos_config)
+	response = version_check(cocos_config['captainUrl'], game_version, config['UserAgent'], config['DeviceID'], session)
+	if response.get('status') != 0:
+		logging.warning(f"Version check for {client.name} failed with status {response.get('status')}.")
+		return False
+
+	httpData = response.get('data') or {}
+	data = httpData.get('data') or {}
+	if httpData.get('ret') == 2:
+		logging.info(f"The server of {client.name} is currently in maintanance mode.")
+		return False
+
+	latest_version = int(data.get('targetV', 0))
+	latest_patch_version = int((data.get('patchInfo') or {}).get('patchVersion', 0))
+	if latest_version > game_version or latest_patch_version > patch_version:
+		logging.info(f"New version for {client.name} - Game: {latest_version}, Patch: {latest_patch_version}.")
+		main(client, config, cocos_config, update_repository, response, session)
+	return True
+
+def run_daemon(clients: list[Client], interval: float, jitter: float, max_backoff: float):
+	"""
+	Polls the version check of all clients on a schedule and keeps the configs,
+	the repository and the http session loaded between checks.  
+	Failed checks and maintenance responses back off exponentially up to max_backoff seconds.
+	"""
+	config = JsonConfig('config.json')
+	import requests
+	from git import Repo
+	session = requests.Session()
+	update_repository = Repo(str(Path(config["AssetRepo"])))
+	cocos_configs = {
+		client: JsonConfig(Path(config['AssetDir'].format(client = client.locale_code), "cocos_app.conf"))
+		for client in clients
+	}
+	failures = dict.fromkeys(clients, 0)
+
+	schedule = [(time.monotonic(), client.value, client) for client in clients]
+	heapq.heapify(schedule)
+	while True:
+		due_time, _, client = heapq.heappop(schedule)
+		time.sleep(max(due_time - time.monotonic(), 0))
+		try:
+			success = poll_client(client, config, cocos_configs[client], update_repository, session)
+		except (Exception, SystemExit):
+			logging.exception(f"Version check for {client.name} failed.")
+			success = False
+
+		if success:
+			failures[client] = 0
+			delay = interval
+		else:
+			failures[client] += 1
+			delay = min(interval * 2**failures[client], max_backoff)
+		delay += random.uniform(0, jitter)
+		logging.debug(f"Next version check for {client.name} in {delay:.0f} seconds.")
+		heapq.heappush(schedule, (time.monotonic() + delay, client.value, client))
+
+
+def setup_logging():
 	# set up logger to file
 	logging.basicConfig(level=logging.DEBUG, format="[%(asctime)s] [%(levelname)s]: %(message)s", datefmt="%x %X", filename="update_dbg.log")
 	# set up logging to error file
@@ -247,10 +609,30 @@ if __name__ == "__main__":
 	logging.getLogger("").addHandler(console)
 	logging.debug("##############################")
 
+def add_arguments(parser: argparse.ArgumentParser):
+	parser.add_argument('-c', '--client', required=True, type=str, nargs='+', help="The clients to apply the action to.")
+	parser.add_argument('--daemon', action='store_true', help="Keeps running and polls the version check of the clients on a schedule.")
+	parser.add_argument('--interval', type=float, default=300, help="Seconds between two version checks of a client in daemon mode.")
+	parser.add_argument('--jitter', type=float, default=30, help="Maximum random seconds added to each interval in daemon mode.")
+	parser.add_argument('--max-backoff', type=float, default=3600, help="Maximum seconds between version checks after failures or during maintenance.")
+	parser.add_argument('--profile', metavar='DIR', type=str, nargs='?', const='', help="Profiles the cpu time and memory of every update step and writes the results into DIR, by default into profile/<time>.")
+
+def run(args: argparse.Namespace):
+	setup_logging()
+	clients = [Client[client] for client in args.client]
+	if args.profile is not None:
+		profiling.enable(args.profile or Path("profile", time.strftime("%Y%m%d-%H%M%S")))
+
+	# execute main with given clients
+	if args.daemon:
+		run_daemon(clients, args.interval, args.jitter, args.max_backoff)
+	else:
+		for client in clients:
+			main(client)
+
+
+if __name__ == "__main__":
 	# execute parser to allow easy commandline execution
 	parser = argparse.ArgumentParser()
-	parser.add_argument('-c', '--client', required=True, type=str, help="The client to apply the action to.")
-	args = parser.parse_args()
-
-	# execute main with given client
-	main(Client[args.client])
\ No newline at end of file
+	add_arguments(parser)
+	run(parser.parse_args())
\ No newline at end of file